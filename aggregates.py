@@ -0,0 +1,139 @@
+import heapq
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class TopK:
+    """Space-Saving heavy-hitters sketch: approximate counts of the most frequent items.
+
+    At most capacity items are tracked. A new item arriving when the sketch
+    is full replaces the one with the smallest count and inherits that count
+    as its possible overestimate, so any item seen more than total/capacity
+    times is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}  # item -> how much its count may be overestimated
+
+    def add(self, item: str, count: int = 1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            # Scans a fixed-size dict, and only when an untracked item arrives
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[item] = floor + count
+            self.errors[item] = floor
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        return heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+
+    def to_dict(self) -> Dict:
+        return {'capacity': self.capacity, 'counts': self.counts, 'errors': self.errors}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TopK':
+        sketch = cls(data.get('capacity', 100))
+        sketch.counts = dict(data.get('counts', {}))
+        sketch.errors = dict(data.get('errors', {}))
+        return sketch
+
+
+class RunningStats:
+    """Question and feedback aggregates kept up to date on every change.
+
+    Holds per-subject question counts, feedback sum and count (overall and
+    per subject), the last recent_window ratings and a TopK sketch of
+    question keywords. Each update is O(1), so reading the dashboard does
+    not depend on how much history there is.
+    """
+
+    def __init__(self, recent_window: int = 10, keyword_capacity: int = 100):
+        self.questions = 0
+        self.subject_counts = Counter()
+        self.feedback_sum = 0
+        self.feedback_count = 0
+        self.subject_feedback = {}  # subject -> [sum, count]
+        self.recent_feedback = deque(maxlen=recent_window)
+        self.keywords = TopK(keyword_capacity)
+
+    def record_question(self, subject: str, keywords: Iterable[str]):
+        self.questions += 1
+        self.subject_counts[subject] += 1
+        for keyword in keywords:
+            self.keywords.add(keyword)
+
+    def record_feedback(self, subject: str, rating: int):
+        self.feedback_sum += rating
+        self.feedback_count += 1
+        totals = self.subject_feedback.setdefault(subject, [0, 0])
+        totals[0] += rating
+        totals[1] += 1
+        self.recent_feedback.append(rating)
+
+    def average_feedback(self, subject: Optional[str] = None, default: float = 0.0) -> float:
+        """Mean rating overall, or for subject; default when there is none"""
+        total, count = self.subject_feedback.get(subject, (0, 0)) if subject else (self.feedback_sum, self.feedback_count)
+        return total / count if count else default
+
+    def recent_average(self) -> float:
+        return sum(self.recent_feedback) / len(self.recent_feedback) if self.recent_feedback else 0.0
+
+    def summary(self, top_keywords: int = 10) -> Dict:
+        """The aggregates as plain JSON-ready values"""
+        return {
+            'questions': self.questions,
+            'subjects': dict(self.subject_counts.most_common()),
+            'feedback': {
+                'count': self.feedback_count,
+                'average': self.average_feedback(),
+                'recent_average': self.recent_average(),
+                'recent_window': self.recent_feedback.maxlen,
+                'by_subject': {subject: self.average_feedback(subject) for subject in self.subject_feedback}
+            },
+            'top_keywords': [{'keyword': keyword, 'count': count} for keyword, count in self.keywords.top(top_keywords)]
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            'questions': self.questions,
+            'subject_counts': dict(self.subject_counts),
+            'feedback_sum': self.feedback_sum,
+            'feedback_count': self.feedback_count,
+            'subject_feedback': self.subject_feedback,
+            'recent_feedback': list(self.recent_feedback),
+            'recent_window': self.recent_feedback.maxlen,
+            'keywords': self.keywords.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RunningStats':
+        stats = cls(data.get('recent_window', 10))
+        stats.questions = data.get('questions', 0)
+        stats.subject_counts = Counter(data.get('subject_counts', {}))
+        stats.feedback_sum = data.get('feedback_sum', 0)
+        stats.feedback_count = data.get('feedback_count', 0)
+        stats.subject_feedback = {subject: list(totals) for subject, totals in data.get('subject_feedback', {}).items()}
+        stats.recent_feedback.extend(data.get('recent_feedback', []))
+        stats.keywords = TopK.from_dict(data.get('keywords', {}))
+        return stats
+
+    @classmethod
+    def from_history(cls, history: List[Dict], feedback: Dict[str, List[int]]) -> 'RunningStats':
+        """Seed the aggregates from a snapshot saved before they existed"""
+        stats = cls()
+        for entry in history:
+            stats.record_question(entry['subject'], entry.get('keywords', []))
+        for subject, ratings in feedback.items():
+            for rating in ratings:
+                stats.record_feedback(subject, rating)
+        # The rolling window follows the order ratings were given, which only the history has
+        stats.recent_feedback.clear()
+        stats.recent_feedback.extend(entry['feedback'] for entry in history if entry.get('feedback'))
+        return stats
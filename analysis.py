@@ -0,0 +1,34 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Words that say what kind of question it is, not what it is about
+QUESTION_WORDS = frozenset({'what', 'how', 'why', 'when', 'where', 'who', 'which', 'does', 'can', 'will',
+                            'would', 'should', 'could', 'tell', 'explain', 'describe'})
+
+
+def question_keywords(tokens: Iterable[str]) -> List[str]:
+    """Key terms of a tokenized question, in order, for knowledge retrieval"""
+    return [word for word in tokens if word not in QUESTION_WORDS and len(word) > 2]
+
+
+class RequestAnalysis:
+    """What answering one question needs to know about it, worked out once.
+
+    EnhancedLearningQABot.analyze builds it before anything is learned from
+    the question, and each stage of generate_response reads it instead of
+    tokenizing, classifying or extracting keywords again. subject_scores is
+    None when the subject came from a batch classification.
+    confidence_factors is filled in once the question has been recorded,
+    because the factors depend on it.
+    """
+
+    __slots__ = ('question', 'tokens', 'token_set', 'keywords', 'subject_scores', 'subject', 'confidence_factors')
+
+    def __init__(self, question: str, tokens: Tuple[str, ...], subject: str,
+                 subject_scores: Optional[Dict[str, float]] = None):
+        self.question = question
+        self.tokens = tokens
+        self.token_set = frozenset(tokens)
+        self.keywords = question_keywords(tokens)
+        self.subject_scores = subject_scores
+        self.subject = subject
+        self.confidence_factors = None
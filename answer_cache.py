@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from persistence import BackgroundWriter, JournalStore
+from text_index import TokenIndex
+
+# Stripped from either end of a word; anything inside a word (5*7, e-mail) is kept
+SENTENCE_PUNCTUATION = '.,;:!?¿¡"\'()[]{}'
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Cache key: every lowercased word of the prompt, short words and digits included, minus sentence punctuation"""
+    return ' '.join(word for word in (w.strip(SENTENCE_PUNCTUATION) for w in prompt.lower().split()) if word)
+
+
+def fold_prompt(prompt: str) -> str:
+    """The prompt with only case and whitespace folded, so prompts sharing it ask exactly the same thing"""
+    return ' '.join(prompt.lower().split())
+
+
+class AnswerCache:
+    """LRU cache of LLM answers keyed by normalized prompt.
+
+    Entries expire ttl seconds after they were stored and the least recently
+    used entry is evicted beyond max_entries. When near_duplicate_threshold is
+    set, a miss falls back to the cached prompt with the highest token Jaccard
+    at or above it. Insertions and forgotten prompts go to a journal on a
+    background writer and are replayed (oldest first, with the same bounds)
+    on the next start; sync() picks up the answers other worker processes
+    sharing the file have cached or forgotten.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: float = 7 * 24 * 3600,
+                 near_duplicate_threshold: Optional[float] = None, save_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.entries = OrderedDict()  # key -> (answer, stored_at)
+        self.index = TokenIndex()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self.store = JournalStore(path, compact_every=max(100, max_entries))
+        self.load()
+        self.writer = BackgroundWriter(self.store, interval=save_interval)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        try:
+            snapshot, records = self.store.load()
+        except Exception as e:
+            print(f"Error loading answer cache: {e}")
+            return
+        for key, answer, stored_at in (snapshot or {}).get('entries', []):
+            self._insert(key, answer, stored_at)
+        for record in records:
+            self._replay(record)
+
+    def _replay(self, record: Dict):
+        if record.get('op') == 'put':
+            self._insert(record['key'], record['answer'], record['stored_at'])
+        elif record.get('op') == 'drop' and record['key'] in self.entries:
+            self._drop(record['key'])
+
+    def sync(self):
+        """Add the answers other worker processes have cached since the last sync"""
+        with self._lock:
+            records = self.store.poll()
+            if records is None:
+                # Another process compacted the journal: reload it
+                self.writer.flush()
+                self.entries.clear()
+                self.index.clear()
+                self.load()
+                return
+            for record in records:
+                self._replay(record)
+
+    def _insert(self, key: str, answer: str, stored_at: float):
+        if time.time() - stored_at > self.ttl:
+            return
+        self.entries[key] = (answer, stored_at)
+        self.entries.move_to_end(key)
+        if self.near_duplicate_threshold:
+            self.index.add(key, key.split())
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        del self.entries[key]
+        self.index.remove(key)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttl:
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Return the cached answer for prompt, or None on a miss"""
+        key = normalize_prompt(prompt)
+        if not key:
+            return None
+        with self._lock:
+            answer = self._lookup(key)
+            if answer is not None:
+                self.hits += 1
+                return answer
+            if self.near_duplicate_threshold:
+                for match, _ in self.index.query(key.split(), self.near_duplicate_threshold, top_k=3):
+                    answer = self._lookup(match)
+                    if answer is not None:
+                        self.near_hits += 1
+                        return answer
+            self.misses += 1
+            return None
+
+    def put(self, prompt: str, answer: str):
+        key = normalize_prompt(prompt)
+        if not key:
+            return
+        stored_at = time.time()
+        with self._lock:
+            self._insert(key, answer, stored_at)
+            self.writer.append({'op': 'put', 'key': key, 'answer': answer, 'stored_at': stored_at})
+            if self.writer.needs_compaction:
+                self.writer.compact({'entries': [[k, a, t] for k, (a, t) in self.entries.items()]})
+
+    def forget(self, prompts) -> int:
+        """Drop the cached answers for prompts, in every worker; returns how many were cached"""
+        dropped = 0
+        with self._lock:
+            for key in {normalize_prompt(prompt) for prompt in prompts} - {''}:
+                # Journaled even when not cached here, since another worker may hold it
+                self.writer.append({'op': 'drop', 'key': key})
+                if key in self.entries:
+                    self._drop(key)
+                    dropped += 1
+        return dropped
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits + self.near_hits) / lookups if lookups else 0.0
+            }
+
+    def close(self):
+        self.writer.close()
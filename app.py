@@ -1,126 +1,25 @@
-from flask import Flask, request, jsonify, render_template_string
+import json
+import os
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
 # Import the AI bot class
 from import_re import EnhancedLearningQABot
+from sessions import valid_session_id
+from web_ui import INDEX_HTML
 
 app = Flask(__name__)
 
 # Instantiate the bot once
-bot = EnhancedLearningQABot()
+bot = EnhancedLearningQABot(save_interval=float(os.environ.get('LIAM_SAVE_INTERVAL', 1.0)))
+max_batch_size = int(os.environ.get('LIAM_MAX_BATCH', 1000))
 
 @app.route('/')
 def home():
-    return render_template_string("""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Liam AI Web UI</title>
-        <style>
-            body {
-                font-family: 'Segoe UI', Arial, sans-serif;
-                background: linear-gradient(120deg, #f8fafc 0%, #e0e7ef 100%);
-                margin: 0;
-                padding: 0;
-                min-height: 100vh;
-            }
-            h1 {
-                text-align: center;
-                color: #2d3a4b;
-                margin-top: 40px;
-                margin-bottom: 30px;
-                letter-spacing: 1px;
-            }
-            #ai-form {
-                background: #fff;
-                max-width: 420px;
-                margin: 0 auto;
-                padding: 32px 28px 24px 28px;
-                border-radius: 18px;
-                box-shadow: 0 4px 24px rgba(44, 62, 80, 0.08);
-                display: flex;
-                flex-direction: column;
-                gap: 18px;
-            }
-            #user-input {
-                padding: 12px 14px;
-                border: 1px solid #cfd8dc;
-                border-radius: 8px;
-                font-size: 1.1em;
-                outline: none;
-                transition: border 0.2s;
-            }
-            #user-input:focus {
-                border: 1.5px solid #5b9df9;
-            }
-            label {
-                display: flex;
-                align-items: center;
-                font-size: 1em;
-                color: #3a4a5d;
-                gap: 8px;
-            }
-            button {
-                background: linear-gradient(90deg, #5b9df9 0%, #3a8dde 100%);
-                color: #fff;
-                border: none;
-                border-radius: 8px;
-                padding: 12px 0;
-                font-size: 1.1em;
-                font-weight: 600;
-                cursor: pointer;
-                box-shadow: 0 2px 8px rgba(44, 62, 80, 0.07);
-                transition: background 0.2s, transform 0.1s;
-            }
-            button:hover {
-                background: linear-gradient(90deg, #3a8dde 0%, #5b9df9 100%);
-                transform: translateY(-2px) scale(1.03);
-            }
-            #result {
-                max-width: 420px;
-                margin: 32px auto 0 auto;
-                background: #fff;
-                border-radius: 14px;
-                box-shadow: 0 2px 12px rgba(44, 62, 80, 0.07);
-                padding: 22px 20px;
-                font-size: 1.08em;
-                color: #2d3a4b;
-                min-height: 40px;
-                word-break: break-word;
-                white-space: pre-line;
-            }
-            @media (max-width: 600px) {
-                #ai-form, #result {
-                    max-width: 98vw;
-                    padding: 16px 6vw;
-                }
-                h1 {
-                    font-size: 1.3em;
-                }
-            }
-        </style>
-    </head>
-    <body>
-        <h1>Liam AI Web Interface</h1>
-        <form id="ai-form">
-            <input type="text" id="user-input" placeholder="Enter your input" required>
-            <button type="submit">Submit</button>
-        </form>
-        <div id="result"></div>
-        <script>
-        document.getElementById('ai-form').onsubmit = async function(e) {
-            e.preventDefault();
-            const userInput = document.getElementById('user-input').value;
-            const response = await fetch('/predict', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({input: userInput, use_gemini: true})
-            });
-            const data = await response.json();
-            document.getElementById('result').innerText = data.message || JSON.stringify(data);
-        }
-        </script>
-    </body>
-    </html>
-    """)
+    return render_template_string(INDEX_HTML)
+
+def request_session(data):
+    """The caller's session, by 'session_id' in the body or the X-Session-Id header; new if unknown"""
+    session_id = (data or {}).get('session_id') or request.headers.get('X-Session-Id')
+    return bot.sessions.get(valid_session_id(session_id))
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -128,11 +27,70 @@ def predict():
     user_input = data.get('input') if data else None
     if not user_input:
         return jsonify({"error": "No input provided"}), 400
-    response = bot.ask_gemini(user_input)
-    return jsonify({"message": response})
+    session = request_session(data)
+    # Learned responses, then the knowledge base / math engine, then Gemini
+    response = jsonify(dict(bot.answer_tiered(user_input, session=session), session_id=session.session_id))
+    response.headers['X-Session-Id'] = session.session_id
+    return response
 
-import os
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    data = request.get_json()
+    user_input = data.get('input') if data else None
+    if not user_input:
+        return jsonify({"error": "No input provided"}), 400
+    session = request_session(data)
+
+    def events():
+        for event, payload in bot.answer_stream(user_input, session=session):
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    # Disable proxy buffering so each chunk reaches the browser immediately
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no',
+                             'X-Session-Id': session.session_id})
+
+@app.route('/feedback', methods=['POST'])
+def feedback():
+    data = request.get_json(silent=True)
+    rating = data.get('rating') if isinstance(data, dict) else None
+    if not isinstance(rating, int) or not 1 <= rating <= 5:
+        return jsonify({"error": "'rating' must be an integer from 1 to 5"}), 400
+    session = request_session(data)
+    # Rates this session's last answer, not whichever user spoke last
+    return jsonify({"message": bot.get_feedback(rating, session), "session_id": session.session_id})
+
+@app.route('/stats')
+def stats():
+    # Running aggregates, so polling this stays cheap however long the bot has run
+    return jsonify(bot.stats())
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    data = request.get_json(silent=True)
+    inputs = data.get('inputs') if isinstance(data, dict) else None
+    error = batch_input_error(inputs)
+    if error:
+        return jsonify({"error": error}), 400
+    session = request_session(data)
+    # One classification pass over the batch; only local misses go to Gemini, concurrently
+    return jsonify({"results": bot.answer_batch(inputs, session=session), "session_id": session.session_id})
+
+def batch_input_error(inputs):
+    """Why inputs is not a valid batch, or None"""
+    if not isinstance(inputs, list) or not inputs:
+        return "'inputs' must be a non-empty list of questions"
+    if len(inputs) > max_batch_size:
+        return f"At most {max_batch_size} inputs per batch"
+    if not all(isinstance(question, str) and question.strip() for question in inputs):
+        return "Every input must be a non-empty string"
+    return None
+
+import signal
+import sys
 
 if __name__ == '__main__':
+    # Turn SIGTERM into a normal exit so atexit flushes pending saves
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,304 @@
+"""ASGI entry point: ``uvicorn asgi:app``.
+
+Serves the same routes as app.py without a framework. Gemini calls are
+awaited on the event loop, so a slow LLM request holds no thread; the
+CPU-bound local engine (classification, knowledge base, learning) runs on a
+small bounded executor. LIAM_MAX_CONCURRENCY caps the requests being
+answered at once; further requests wait for a slot. A batch takes one slot
+and runs up to LIAM_BATCH_CONCURRENCY Gemini calls of its own.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+from answer_cache import fold_prompt
+from import_re import EnhancedLearningQABot
+from llm import LLMError
+from sessions import SessionState, valid_session_id
+from web_ui import INDEX_HTML
+
+bot = EnhancedLearningQABot(save_interval=float(os.environ.get('LIAM_SAVE_INTERVAL', 1.0)))
+# The local engine is GIL-bound, so extra threads add contention rather than throughput
+local_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('LIAM_LOCAL_WORKERS', 1)),
+                                    thread_name_prefix='liam-local')
+max_concurrency = int(os.environ.get('LIAM_MAX_CONCURRENCY', 500))
+batch_concurrency = int(os.environ.get('LIAM_BATCH_CONCURRENCY', 16))
+max_batch_size = int(os.environ.get('LIAM_MAX_BATCH', 1000))
+_slots = None
+
+
+def request_slots() -> asyncio.Semaphore:
+    """Semaphore created lazily so it binds to the server's event loop"""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max_concurrency)
+    return _slots
+
+
+async def run_local(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(local_executor, func, *args)
+
+
+async def fetch_gemini(question: str) -> str:
+    """Ask Gemini, then cache and learn the answer"""
+    answer = await bot.llm.generate_async(bot.gemini_prompt(question))
+    await run_local(bot.answer_cache.put, question, answer)
+    await run_local(bot.store_learned_qa, question, answer)
+    return answer
+
+
+async def query_gemini(question: str) -> str:
+    """The cached answer, else one Gemini call shared by concurrent requests; raises LLMError"""
+    answer = bot.answer_cache.get(question)
+    if answer is None:
+        answer = await bot.gemini_flight.do_async(fold_prompt(question), lambda: fetch_gemini(question))
+    return answer
+
+
+async def answer_tiered(question: str, session: SessionState) -> Dict:
+    """Async counterpart of EnhancedLearningQABot.answer_tiered"""
+    timings = {}
+    result = await run_local(bot.answer_local, question, bot.min_confidence, timings, None, session)
+    if result:
+        return result
+
+    started = time.perf_counter()
+    try:
+        answer = await query_gemini(question)
+    except LLMError as e:
+        answer = str(e)
+    else:
+        await run_local(bot.remember_gemini_answer, question, answer, session)
+    timings['gemini'] = (time.perf_counter() - started) * 1000
+    return {'message': answer, 'tier': 'gemini', 'confidence': None, 'timings_ms': timings}
+
+
+async def answer_batch(questions: List[str], session: SessionState) -> List[Dict]:
+    """Async counterpart of EnhancedLearningQABot.answer_batch"""
+    results, misses = await run_local(bot.answer_local_batch, questions, bot.min_confidence, session)
+    groups = defaultdict(list)
+    for position, timings in misses:
+        groups[fold_prompt(questions[position])].append((position, timings))
+    fan_out = asyncio.Semaphore(batch_concurrency)
+
+    async def ask(group):
+        question = questions[group[0][0]]
+        async with fan_out:
+            started = time.perf_counter()
+            try:
+                message = await query_gemini(question)
+            except LLMError as e:
+                message = str(e)
+            elapsed = (time.perf_counter() - started) * 1000
+        for position, timings in group:
+            timings['gemini'] = elapsed
+            results[position] = {'message': message, 'tier': 'gemini', 'confidence': None, 'timings_ms': timings}
+
+    await asyncio.gather(*(ask(group) for group in groups.values()))
+    return results
+
+
+async def answer_stream(question: str, session: SessionState):
+    """Async counterpart of EnhancedLearningQABot.answer_stream"""
+    timings = {}
+    result = await run_local(bot.answer_local, question, bot.min_confidence, timings, None, session)
+    if result:
+        yield 'chunk', {'text': result.pop('message')}
+        yield 'done', result
+        return
+
+    started = time.perf_counter()
+    key = fold_prompt(question)
+    answer = bot.answer_cache.get(question)
+    shared = None if answer is not None else bot.gemini_flight.lead_async(key)
+    if answer is not None:
+        yield 'chunk', {'text': answer}
+    elif shared is not None:
+        try:
+            answer = await asyncio.shield(shared)
+        except LLMError as e:
+            yield 'error', {'message': str(e)}
+            return
+        yield 'chunk', {'text': answer}
+    else:
+        chunks = []
+        # Replaced on completion; followers see it if the client goes away mid-stream
+        error = LLMError("The answer stream was interrupted")
+        try:
+            async for chunk in bot.llm.stream_async(bot.gemini_prompt(question)):
+                if not chunks:
+                    timings['gemini_first_chunk'] = (time.perf_counter() - started) * 1000
+                chunks.append(chunk)
+                yield 'chunk', {'text': chunk}
+            answer = ''.join(chunks).strip()
+            await run_local(bot.answer_cache.put, question, answer)
+            await run_local(bot.store_learned_qa, question, answer)
+            error = None
+        except LLMError as e:
+            error = e
+        finally:
+            bot.gemini_flight.finish_async(key, answer, error)
+        if error:
+            yield 'error', {'message': str(error)}
+            return
+    await run_local(bot.remember_gemini_answer, question, answer, session)
+    timings['gemini'] = (time.perf_counter() - started) * 1000
+    yield 'done', {'tier': 'gemini', 'confidence': None, 'timings_ms': timings}
+
+
+async def read_json(receive) -> Dict:
+    """The request body parsed as a JSON object, or {}"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    return data if isinstance(data, dict) else {}
+
+
+async def read_input(scope, receive):
+    """The JSON body and its 'input' field (or the query string's), or None"""
+    data = await read_json(receive)
+    query = parse_qs(scope.get('query_string', b'').decode())
+    return data, data.get('input') or (query.get('input') or [None])[0]
+
+
+def request_session(scope, data: Dict) -> SessionState:
+    """The caller's session, by 'session_id' in the body or the X-Session-Id header; new if unknown"""
+    session_id = data.get('session_id') or dict(scope.get('headers', [])).get(b'x-session-id', b'').decode('latin-1')
+    return bot.sessions.get(valid_session_id(session_id))
+
+
+def batch_input_error(inputs):
+    """Why inputs is not a valid batch, or None (same checks as app.py)"""
+    if not isinstance(inputs, list) or not inputs:
+        return "'inputs' must be a non-empty list of questions"
+    if len(inputs) > max_batch_size:
+        return f"At most {max_batch_size} inputs per batch"
+    if not all(isinstance(question, str) and question.strip() for question in inputs):
+        return "Every input must be a non-empty string"
+    return None
+
+
+async def send_response(send, status: int, body: bytes, content_type: str, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status: int, payload: Dict, session: SessionState = None):
+    headers = [(b'x-session-id', session.session_id.encode())] if session else []
+    await send_response(send, status, json.dumps(payload).encode(), 'application/json', headers)
+
+
+async def predict(scope, receive, send):
+    data, user_input = await read_input(scope, receive)
+    if not user_input:
+        return await send_json(send, 400, {"error": "No input provided"})
+    session = request_session(scope, data)
+    async with request_slots():
+        result = await answer_tiered(user_input, session)
+    await send_json(send, 200, dict(result, session_id=session.session_id), session)
+
+
+async def predict_stream(scope, receive, send):
+    data, user_input = await read_input(scope, receive)
+    if not user_input:
+        return await send_json(send, 400, {"error": "No input provided"})
+    session = request_session(scope, data)
+    async with request_slots():
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no'), (b'x-session-id', session.session_id.encode())]})
+        async for event, payload in answer_stream(user_input, session):
+            frame = f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            await send({'type': 'http.response.body', 'body': frame.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def predict_batch(scope, receive, send):
+    data = await read_json(receive)
+    inputs = data.get('inputs')
+    error = batch_input_error(inputs)
+    if error:
+        return await send_json(send, 400, {"error": error})
+    session = request_session(scope, data)
+    async with request_slots():
+        results = await answer_batch(inputs, session)
+    await send_json(send, 200, {"results": results, "session_id": session.session_id}, session)
+
+
+async def feedback(scope, receive, send):
+    data = await read_json(receive)
+    rating = data.get('rating')
+    if not isinstance(rating, int) or not 1 <= rating <= 5:
+        return await send_json(send, 400, {"error": "'rating' must be an integer from 1 to 5"})
+    session = request_session(scope, data)
+    message = await run_local(bot.get_feedback, rating, session)
+    await send_json(send, 200, {"message": message, "session_id": session.session_id}, session)
+
+
+async def stats(scope, receive, send):
+    # Off the event loop: the read lock can wait behind a write
+    await send_json(send, 200, await run_local(bot.stats))
+
+
+async def home(scope, receive, send):
+    await send_response(send, 200, INDEX_HTML.encode(), 'text/html; charset=utf-8')
+
+
+ROUTES = {
+    ('GET', '/'): home,
+    ('POST', '/predict'): predict,
+    ('POST', '/predict/stream'): predict_stream,
+    ('POST', '/predict/batch'): predict_batch,
+    ('POST', '/feedback'): feedback,
+    ('GET', '/stats'): stats,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Flush pending saves before the worker exits
+            await asyncio.get_running_loop().run_in_executor(None, bot.close)
+            local_executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        return await send_json(send, 404, {"error": "Not found"})
+    response_started = False
+
+    async def tracked_send(message):
+        nonlocal response_started
+        response_started = response_started or message['type'] == 'http.response.start'
+        await send(message)
+
+    try:
+        await handler(scope, receive, tracked_send)
+    except Exception as e:
+        print(f"Error handling {scope['path']}: {e}")
+        if not response_started:
+            await send_json(send, 500, {"error": "Internal server error"})
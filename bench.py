@@ -0,0 +1,424 @@
+"""Micro-benchmarks for the local answering engine.
+
+Run ``python bench.py`` for every benchmark or ``python bench.py NAME ...``
+for a subset. Numbers are printed; benchmarks that check results (stress,
+batch) return False when a check fails, and the run then exits with status 1.
+"""
+import heapq
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from analysis import question_keywords
+from answer_cache import AnswerCache
+from bounded import StateLimits
+from import_re import EnhancedLearningQABot
+from llm import FakeBackend, LLMClient
+from sessions import SessionTable
+from text_index import NearDuplicateIndex, SemanticIndex, hashed_features, tokenize_text
+
+
+def sample_questions(bot, count, seed=0):
+    """Build questions mixing subject keywords with filler words"""
+    rng = random.Random(seed)
+    vocabulary = sorted({kw.lower() for keywords in bot.subject_keywords.values() for kw in keywords})
+    filler = ['what', 'how', 'does', 'explain', 'the', 'about', 'work', 'why', 'difference', 'between']
+    questions = []
+    for _ in range(count):
+        words = rng.sample(filler, 2) + rng.sample(vocabulary, rng.randint(1, 4))
+        rng.shuffle(words)
+        questions.append(' '.join(words) + '?')
+    return questions
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_classify_subjects(bot, count=5000):
+    """Batched classify_subjects against a per-question classify_subject loop"""
+    questions = sample_questions(bot, count)
+    bot.classify_subjects(questions[:10])  # compile the term matrix once
+
+    _, loop_time = timed(lambda: [bot.classify_subject(q) for q in questions])
+    _, batch_time = timed(bot.classify_subjects, questions)
+    print(f"classify_subjects: {count} questions")
+    print(f"  per-item loop: {count / loop_time:10.0f} q/s")
+    print(f"  batched:       {count / batch_time:10.0f} q/s  ({loop_time / batch_time:.1f}x)")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_fake_llm(bot, count=200, concurrency=16):
+    """Concurrent ask_gemini calls against the in-process fake backend.
+
+    The first pass misses the answer cache; the second repeats the same
+    questions with different casing and punctuation and should be served
+    from it.
+    """
+    client = LLMClient(FakeBackend('lognormal', mean=0.05, spread=0.5, seed=0), timeout=0.2)
+    cache = AnswerCache(os.path.join(tempfile.mkdtemp(), 'answers.json'))
+    original = bot.llm, bot.answer_cache
+    bot.llm, bot.answer_cache = client, cache
+    questions = sample_questions(bot, count)
+
+    def ask(question):
+        return timed(bot.ask_gemini, question)[1]
+
+    print(f"fake_llm: {count} requests, {concurrency} concurrent")
+    try:
+        for label, batch in (('cold', questions), ('repeat', [q.upper().rstrip('?') + '!' for q in questions])):
+            with ThreadPoolExecutor(concurrency) as pool:
+                latencies, elapsed = timed(lambda: list(pool.map(ask, batch)))
+            print(f"  {label:6} throughput: {count / elapsed:10.0f} req/s   "
+                  f"p50 / p99: {percentile(latencies, 0.5) * 1000:6.2f} / {percentile(latencies, 0.99) * 1000:6.2f} ms")
+    finally:
+        bot.llm, bot.answer_cache = original
+        cache.close()
+    stats = client.stats()
+    print(f"  llm errors: {stats['errors']} ({stats['timeouts']} timeouts), cache: {cache.stats()}")
+
+
+def bench_batch(bot, count=200):
+    """answer_batch against an answer_tiered loop, Gemini answers from the fake backend.
+
+    Each mode gets its own questions (a quarter of them repeated) so neither
+    is served answers the other learned.
+    """
+    client = LLMClient(FakeBackend('lognormal', mean=0.05, spread=0.5, seed=0), timeout=1.0)
+    cache = AnswerCache(os.path.join(tempfile.mkdtemp(), 'answers.json'))
+    original = bot.llm, bot.answer_cache
+    bot.llm, bot.answer_cache = client, cache
+    print(f"batch: {count} questions")
+    try:
+        for label, seed in (('loop', 1), ('batch', 2)):
+            questions = sample_questions(bot, count - count // 4, seed=seed)
+            questions += questions[:count // 4]
+            if label == 'loop':
+                results, elapsed = timed(lambda: [bot.answer_tiered(q) for q in questions])
+            else:
+                results, elapsed = timed(bot.answer_batch, questions)
+            tiers = Counter(result['tier'] for result in results)
+            print(f"  {label:6} {count / elapsed:10.0f} q/s  {elapsed:6.2f}s  tiers: {dict(tiers)}")
+        distinct = ['What is 5*7?', 'What is 6*8?', 'Who is he?', 'Who is she?']
+        answers = [result['message'] for result in bot.answer_batch(distinct)]
+        separate = len(set(answers)) == len(distinct)
+        print(f"  distinct short questions answered separately: {separate}")
+    finally:
+        bot.llm, bot.answer_cache = original
+        cache.close()
+    print(f"  llm calls: {client.stats()['calls']}")
+    return separate
+
+
+def canonical_state(bot):
+    """ml_state() with sets sorted, for comparing two bots"""
+    state = bot.ml_state()
+    for field in ('dynamic_keywords', 'subject_keywords'):
+        state[field] = {key: sorted(values) for key, values in state[field].items()}
+    state['all_keywords'] = sorted(state['all_keywords'])
+    return json.dumps(state, sort_keys=True)
+
+
+def bench_sessions(bot, count=100000):
+    """Memory held by count active sessions, each with a full context window"""
+    table = SessionTable(max_sessions=count, context_size=bot.sessions.context_size)
+    # Distinct strings per session, as they would arrive from separate requests
+    questions = sample_questions(bot, 200)
+    tracemalloc.start()
+    started = time.perf_counter()
+    for number in range(count):
+        session = table.get(f"user-{number}")
+        for turn in range(table.context_size):
+            session.add_context(''.join(questions[(number + turn) % len(questions)]), 'science')
+        session.prefer('science_style', ['concise'])
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Past the cap the least recently used session goes, so memory stays flat
+    for number in range(count, count + count // 10):
+        table.get(f"user-{number}")
+    print(f"sessions: {count} active, {table.context_size} context entries each")
+    print(f"  memory: {used / 2 ** 20:.1f} MiB ({used / count:.0f} bytes per session), built in {elapsed:.2f}s")
+    print(f"  after {count // 10} more: {table.stats()}")
+
+
+def bench_growth(bot, rounds=6, per_round=1000):
+    """Snapshot size and state counts as a scratch bot keeps meeting new words.
+
+    Uses a tenth of the default limits so the steady state shows up quickly.
+    """
+    limits = StateLimits(**{name: value // 10 for name, value in vars(StateLimits()).items()})
+    data_file = os.path.join(tempfile.mkdtemp(), 'growth.json')
+    scratch = EnhancedLearningQABot(data_file=data_file, compact_every=10 ** 9, save_interval=60,
+                                    llm=LLMClient(FakeBackend('constant', mean=0.0)), limits=limits)
+    questions = sample_questions(scratch, 200, seed=2)
+    rng = random.Random(2)
+    print(f"growth: {rounds} rounds of {per_round} questions, each with two never-seen words")
+    for number in range(rounds):
+        started = time.perf_counter()
+        for turn in range(per_round):
+            unique = f"word{number}x{turn}a word{number}x{turn}b"
+            scratch.generate_response(f"{rng.choice(questions)} {unique}")
+            scratch.get_feedback(rng.choice([1, 2, 4, 5]))
+        elapsed = time.perf_counter() - started
+        size = len(json.dumps(scratch.ml_state(), default=list))
+        print(f"  after {(number + 1) * per_round:>6}: snapshot {size / 1024:7.0f} KiB, "
+              f"vocabulary {len(scratch.word_frequencies)}, keywords {len(scratch.all_keywords)}, "
+              f"learned {sum(map(len, scratch.learned_responses.values()))}, "
+              f"history {len(scratch.conversation_history)}, patterns {len(scratch.question_patterns)} "
+              f"({per_round / elapsed:.0f} q/s)")
+    scratch.close()
+
+
+def bench_stats(bot, sizes=(500, 5000), calls=1000):
+    """Cost of the /stats payload and show_stats as a scratch bot answers more questions"""
+    data_file = os.path.join(tempfile.mkdtemp(), 'stats.json')
+    scratch = EnhancedLearningQABot(data_file=data_file, compact_every=10 ** 9, save_interval=60,
+                                    llm=LLMClient(FakeBackend('constant', mean=0.0)))
+    questions = sample_questions(scratch, 500, seed=3)
+    rng = random.Random(3)
+    print(f"stats: {calls} calls each")
+    answered = 0
+    for size in sizes:
+        for _ in range(size - answered):
+            scratch.generate_response(rng.choice(questions))
+            scratch.get_feedback(rng.randint(1, 5))
+        answered = size
+        _, elapsed = timed(lambda: [scratch.stats() for _ in range(calls)])
+        _, rendered = timed(lambda: [scratch.show_stats() for _ in range(calls)])
+        print(f"  after {size:>5} questions: stats() {elapsed / calls * 1e6:6.1f} us, "
+              f"show_stats() {rendered / calls * 1e6:6.1f} us")
+    scratch.close()
+
+
+def bench_request(bot, count=2000):
+    """Per-question CPU cost of working out a question's analysis, and of all of generate_response.
+
+    "separate" repeats the tokenizing, classification, keyword extraction
+    and confidence factors each stage used to do on its own; "shared" builds
+    one RequestAnalysis. The tokenizer cache is cleared before each question.
+    """
+    data_file = os.path.join(tempfile.mkdtemp(), 'request.json')
+    scratch = EnhancedLearningQABot(data_file=data_file, compact_every=10 ** 9, save_interval=60,
+                                    llm=LLMClient(FakeBackend('constant', mean=0.0)))
+    questions = sample_questions(scratch, count, seed=4)
+    session = scratch.sessions.get()
+
+    def separate(question):
+        for _ in range(4):  # context, dynamic keywords, keywords and similar questions
+            tokenize_text(question)
+        subject = scratch.classify_subject(question, session)
+        keywords = question_keywords(tokenize_text(question))
+        for _ in range(2):  # the history entry and format_response
+            scratch.calculate_confidence_factors(subject, keywords, session)
+
+    def shared(question):
+        analysis = scratch.analyze(question, session)
+        scratch.calculate_confidence_factors(analysis.subject, analysis.keywords, session)
+
+    def cpu_per_question(func):
+        cpu, calls = 0.0, 0
+        for question in questions:
+            tokenize_text.cache_clear()
+            started = time.process_time()
+            func(question)
+            cpu += time.process_time() - started
+            info = tokenize_text.cache_info()
+            calls += info.hits + info.misses
+        return cpu / count * 1e6, calls / count
+
+    print(f"request: {count} questions")
+    pipeline, pipeline_calls = cpu_per_question(lambda question: scratch.generate_response(question, session))
+    for name, func in (('separate', separate), ('shared', shared)):
+        cpu, calls = cpu_per_question(func)
+        print(f"  analysis, {name}: {cpu:5.1f} us CPU, {calls:.1f} tokenizer calls per question")
+    print(f"  whole generate_response: {pipeline:.0f} us CPU, {pipeline_calls:.1f} tokenizer calls per question")
+    scratch.close()
+
+
+# (learned question, reworded question); the last pairs must not match
+PARAPHRASES = [
+    ("how do planets orbit the sun", "how are planets orbiting around the sun"),
+    ("what causes the seasons on earth", "what causes earth's seasons"),
+    ("who wrote romeo and juliet", "romeo and juliet was written by whom"),
+    ("what is the capital of france", "france's capital city"),
+    ("how does photosynthesis work in plants", "explain how plants photosynthesize"),
+    ("explain newton's laws of motion", "newton laws of motion explained"),
+    ("how do vaccines work", "how does a vaccine work"),
+    ("why is the sky blue", "why does the sky look blue"),
+    ("what is machine learning", "machine learning definition"),
+    ("what is the speed of light", "how fast does light travel"),
+]
+UNRELATED = ["how do magnets work", "who painted the mona lisa", "what is the tallest mountain"]
+
+
+def bench_semantic(bot, count=100000, queries=20, loop_queries=3):
+    """Paraphrase hit rate of word overlap vs hashed TF-IDF, and top-k scoring at count items"""
+    scratch_bot = EnhancedLearningQABot(data_file=os.path.join(tempfile.mkdtemp(), 'semantic.json'),
+                                        save_interval=60, llm=LLMClient(FakeBackend('constant', mean=0.0)))
+    threshold = scratch_bot.semantic_threshold
+    scratch_bot.close()
+    overlap, semantic = NearDuplicateIndex(), SemanticIndex()
+    for learned, _ in PARAPHRASES:
+        item = {'question': learned}
+        overlap.add(item)
+        semantic.add(item, 'general')
+
+    def hits(queries_and_answers):
+        found = {'overlap': 0, 'semantic': 0}
+        for query, answer in queries_and_answers:
+            matched = [item['question'] for item, similarity in overlap.similar(query) if similarity > 0.4]
+            found['overlap'] += answer in matched if answer else bool(matched)
+            matched = [item['question'] for item, _ in semantic.search(query, 1, threshold)]
+            found['semantic'] += answer in matched if answer else bool(matched)
+        return found
+
+    paraphrased = hits([(query, learned) for learned, query in PARAPHRASES])
+    false = hits([(query, None) for query in UNRELATED])
+    print(f"semantic: {len(PARAPHRASES)} reworded questions, {len(UNRELATED)} unrelated (threshold {threshold})")
+    print(f"  word overlap: {paraphrased['overlap']} found, {false['overlap']} false matches; "
+          f"with TF-IDF: {paraphrased['semantic']} found, {false['semantic']} false matches")
+
+    index = SemanticIndex()
+    questions = sample_questions(bot, count, seed=5)
+    _, elapsed = timed(lambda: [index.add({'question': question}, 'general') for question in questions])
+    print(f"  indexed {count} questions in {elapsed:.1f}s ({index.matrix[:count].nbytes / 2 ** 20:.0f} MiB matrix)")
+    probes = sample_questions(bot, queries, seed=6)
+    _, elapsed = timed(lambda: [index.search(probe, 5) for probe in probes])
+    vectorized = elapsed / queries
+
+    # The same cosine scores from a Python loop over sparse vectors
+    idf = index._idf()
+    documents = []
+    for buckets, values in index.features:
+        weights = values * idf[buckets]
+        norm = float(np.linalg.norm(weights)) or 1.0
+        documents.append(dict(zip(buckets.tolist(), (weights / norm).tolist())))
+
+    def loop_search(probe):
+        query = index._vector(*hashed_features(probe, index.dim), idf)
+        query = {bucket: float(query[bucket]) for bucket in np.flatnonzero(query)}
+        scores = [sum(query.get(bucket, 0.0) * weight for bucket, weight in document.items())
+                  for document in documents]
+        return heapq.nlargest(5, range(len(scores)), key=scores.__getitem__)
+
+    _, elapsed = timed(lambda: [loop_search(probe) for probe in probes[:loop_queries]])
+    looped = elapsed / loop_queries
+    print(f"  top-5 over {count}: matrix product {vectorized * 1000:.1f} ms, Python loop {looped * 1000:.0f} ms "
+          f"({looped / vectorized:.0f}x)")
+
+
+def bench_tiers(bot):
+    """Which tier answers a repeat, a reworded and a near-miss question to one learned from Gemini"""
+    scratch = EnhancedLearningQABot(data_file=os.path.join(tempfile.mkdtemp(), 'tiers.json'),
+                                    llm=LLMClient(FakeBackend('constant', mean=0.0)))
+    try:
+        scratch.answer_tiered("Who wrote Hamlet?")
+        print(f"tiers: learned from Gemini 'Who wrote Hamlet?' (similarity gate {scratch.learned_similarity})")
+        for question in ("Who wrote Hamlet?", "who wrote hamlet", "Who wrote Macbeth?"):
+            result = scratch.answer_tiered(question)
+            print(f"  {question!r:22} -> {result['tier']:8} {result['message'].splitlines()[0][:60]}")
+    finally:
+        scratch.close()
+
+
+def stress_threads(bot, threads=16, operations=300):
+    """Hammer a scratch bot from many threads, then check its state is consistent.
+
+    Checks that no operation raised, that the history and learned-response
+    indexes agree with the lists they index, and that a bot reloaded from
+    disk (snapshot plus journal) ends up with exactly the live state.
+    """
+    data_file = os.path.join(tempfile.mkdtemp(), 'stress.json')
+    scratch = EnhancedLearningQABot(data_file=data_file, compact_every=200, save_interval=0.01,
+                                    llm=LLMClient(FakeBackend('constant', mean=0.0)))
+    questions = sample_questions(scratch, 200, seed=1)
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(operations):
+            question = rng.choice(questions)
+            action = rng.random()
+            try:
+                if action < 0.3:
+                    scratch.generate_response(question)
+                elif action < 0.5:
+                    scratch.answer_local(question, 30, {})
+                elif action < 0.65:
+                    scratch.store_learned_qa(question, f"answer to {question}")
+                elif action < 0.75:
+                    scratch.get_feedback(rng.randint(1, 5))
+                elif action < 0.8:
+                    scratch.teach_me(rng.choice(['python', 'physics', 'history']), question)
+                elif action < 0.82:
+                    scratch.forget_topic(rng.choice(question.split()))
+                elif action < 0.9:
+                    scratch.classify_subjects(rng.sample(questions, 20))
+                else:
+                    scratch.find_similar_questions(question)
+            except Exception as e:
+                errors.append(repr(e))
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    _, elapsed = timed(lambda: [w.start() for w in workers] and [w.join() for w in workers])
+    scratch.writer.flush()
+
+    history_ok = (len(scratch.history_index) == len(scratch.conversation_history) and
+                  all(scratch.history_index.doc_tokens[position] == frozenset(tokenize_text(entry['question']))
+                      for position, entry in enumerate(scratch.conversation_history)))
+    learned_ok = (all(len(scratch.learned_index[subject]) == len(items)
+                      for subject, items in scratch.learned_responses.items()) and
+                  {id(item) for items in scratch.learned_responses.values() for item in items} ==
+                  {id(item) for item in scratch.semantic_index.items})
+    reloaded = EnhancedLearningQABot(data_file=data_file, llm=scratch.llm)
+    reload_ok = canonical_state(reloaded) == canonical_state(scratch)
+    reloaded.close()
+    scratch.close()
+
+    print(f"stress: {threads} threads x {operations} operations in {elapsed:.2f}s")
+    print(f"  errors: {len(errors)}{' (' + errors[0] + ')' if errors else ''}")
+    print(f"  history index consistent: {history_ok}, learned index consistent: {learned_ok}, "
+          f"reload matches live state: {reload_ok}")
+    return not errors and history_ok and learned_ok and reload_ok
+
+
+BENCHMARKS = {
+    'classify_subjects': bench_classify_subjects,
+    'fake_llm': bench_fake_llm,
+    'batch': bench_batch,
+    'sessions': bench_sessions,
+    'growth': bench_growth,
+    'stats': bench_stats,
+    'request': bench_request,
+    'semantic': bench_semantic,
+    'tiers': bench_tiers,
+    'stress': stress_threads,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    # A scratch bot, so benchmarks never write into the real learning data
+    bot = EnhancedLearningQABot(data_file=os.path.join(tempfile.mkdtemp(), 'bench.json'),
+                                llm=LLMClient(FakeBackend('constant', mean=0.0)))
+    failed = [name for name in names if BENCHMARKS[name](bot) is False]
+    bot.close()
+    if failed:
+        print(f"failed checks: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,78 @@
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class StateLimits:
+    """Caps on learning state that would otherwise grow with uptime; 0 disables a cap.
+
+    Per-key lists (templates, corrections and success records) are ring
+    buffers keeping the newest entries. Vocabulary counts age LFU-style:
+    past the cap every count is halved and those reaching zero are dropped,
+    so words that stop appearing fade out. Keywords, dynamic and promoted
+    keywords (per subject; built-in keywords are never dropped) and keyword
+    preferences past their caps lose the entries with the lowest counts,
+    conversation patterns the least recently seen, and learned responses
+    (per subject) the lowest rated unless a user taught them. Each learned
+    response keeps its newest ratings.
+    """
+
+    def __init__(self, vocabulary: int = 50000, keywords: int = 20000, dynamic_keywords: int = 500,
+                 preferences: int = 5000, history: int = 1000, templates: int = 50,
+                 corrections: int = 100, success_records: int = 50, patterns: int = 5000,
+                 learned: int = 10000, promoted_keywords: int = 200, ratings: int = 50):
+        self.vocabulary = vocabulary
+        self.keywords = keywords
+        self.dynamic_keywords = dynamic_keywords
+        self.preferences = preferences
+        self.history = history
+        self.templates = templates
+        self.corrections = corrections
+        self.success_records = success_records
+        self.patterns = patterns
+        self.learned = learned
+        self.promoted_keywords = promoted_keywords
+        self.ratings = ratings
+
+    @classmethod
+    def from_env(cls) -> 'StateLimits':
+        """Defaults overridden by LIAM_MAX_<NAME>, e.g. LIAM_MAX_VOCABULARY"""
+        defaults = cls()
+        return cls(**{name: int(os.getenv(f'LIAM_MAX_{name.upper()}', value))
+                      for name, value in vars(defaults).items()})
+
+
+def append_bounded(items: List, item, keep: Optional[int]) -> int:
+    """Append item, dropping the oldest entries beyond keep; returns how many were dropped"""
+    items.append(item)
+    excess = len(items) - keep if keep else 0
+    if excess > 0:
+        del items[:excess]
+        return excess
+    return 0
+
+
+def slack(limit: int) -> int:
+    """Size to shrink a capped collection to, so eviction runs once per tenth of the cap"""
+    return limit - max(1, limit // 10)
+
+
+def age_counts(counts: Dict[str, int], limit: int) -> int:
+    """Past limit, halve every count until at most slack(limit) remain above zero; returns the number dropped"""
+    dropped = 0
+    if not limit or len(counts) <= limit:
+        return dropped
+    while len(counts) > slack(limit):
+        for key, count in list(counts.items()):
+            if count // 2:
+                counts[key] = count // 2
+            else:
+                del counts[key]
+                dropped += 1
+    return dropped
+
+
+def lowest(keys: Iterable[str], score: Callable[[str], float], limit: int, size: int) -> List[str]:
+    """The lowest-scoring keys to drop so that size shrinks to slack(limit), ties broken by key"""
+    if not limit or size <= limit:
+        return []
+    return sorted(keys, key=lambda key: (score(key), key))[:size - slack(limit)]
@@ -0,0 +1,293 @@
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Sequence, Set
+
+import numpy as np
+
+STATIC_WEIGHT = 3
+DYNAMIC_WEIGHT = 2
+PARTIAL_WEIGHT = 1
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton reporting every keyword contained in a word.
+
+    Keywords can be inserted at any time; failure links are recomputed lazily
+    on the next search after an insertion.
+    """
+
+    def __init__(self, keywords: Iterable[str] = ()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        self.merged = [set()]
+        self.keywords = set()
+        self._dirty = False
+        for keyword in keywords:
+            self.add(keyword)
+
+    def add(self, keyword: str):
+        if not keyword or keyword in self.keywords:
+            return
+        self.keywords.add(keyword)
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+                self.goto[state][char] = next_state
+            state = next_state
+        self.output[state].add(keyword)
+        self._dirty = True
+
+    def discard(self, keywords: Iterable[str]):
+        """Remove keywords; their trie nodes are reclaimed once dead ones outnumber live ones"""
+        changed = False
+        for keyword in keywords:
+            if keyword not in self.keywords:
+                continue
+            self.keywords.discard(keyword)
+            state = 0
+            for char in keyword:
+                state = self.goto[state][char]
+            self.output[state].discard(keyword)
+            changed = True
+        if not changed:
+            return
+        if len(self.goto) > 2 * sum(map(len, self.keywords)) + 64:
+            remaining = self.keywords
+            self.goto = [{}]
+            self.fail = [0]
+            self.output = [set()]
+            self.keywords = set()
+            for keyword in remaining:
+                self.add(keyword)
+        self._dirty = True
+
+    def _link(self):
+        """Recompute failure links and merged outputs breadth-first"""
+        self.merged = [set() for _ in self.goto]
+        queue = deque()
+        for state in self.goto[0].values():
+            self.fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            # Failure targets are shallower, so their outputs are already merged
+            self.merged[state] = self.output[state] | self.merged[self.fail[state]]
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                queue.append(next_state)
+        self._dirty = False
+
+    def find(self, text: str) -> Set[str]:
+        """Return the set of keywords occurring anywhere in text"""
+        if self._dirty:
+            self._link()
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.merged[state]:
+                found |= self.merged[state]
+        return found
+
+
+class SubjectMatcher:
+    """Compiled form of the subject keyword tables used by classify_subject.
+
+    Each word scores +3 per subject listing it as a keyword, +2 per subject
+    listing it as a dynamic keyword, and +1 for every keyword of a subject it
+    contains or is contained in. Exact hits come from a keyword -> subject
+    weight map, "keyword in word" hits from an Aho-Corasick automaton and
+    "word in keyword" hits from a map of every keyword substring.
+
+    Scoring may run from several reader threads at once; the caches it fills
+    lazily (term weights, automaton links, the term matrix) are guarded by
+    an internal lock. Keyword changes must not overlap with scoring.
+    """
+
+    TERM_CACHE_SIZE = 50000
+
+    def __init__(self, subject_keywords: Dict[str, Set[str]] = None,
+                 dynamic_keywords: Dict[str, Set[str]] = None):
+        self._lock = threading.RLock()
+        self.rebuild(subject_keywords or {}, dynamic_keywords or {})
+
+    def rebuild(self, subject_keywords: Dict[str, Set[str]], dynamic_keywords: Dict[str, Set[str]]):
+        """Compile the tables from scratch"""
+        self.keyword_subjects = defaultdict(list)
+        self.exact = defaultdict(lambda: defaultdict(int))
+        self.substrings = defaultdict(set)
+        self.dynamic = defaultdict(set)
+        self.automaton = KeywordAutomaton()
+        self._term_cache = {}
+        self._reset_term_matrix(())
+        for subject, keywords in subject_keywords.items():
+            self.add_keywords(subject, keywords)
+        for subject, keywords in dynamic_keywords.items():
+            for keyword in keywords:
+                self.add_dynamic(subject, keyword)
+
+    def add_keywords(self, subject: str, keywords: Iterable[str]):
+        """Register static keywords for a subject"""
+        changed = False
+        for keyword in keywords:
+            if subject in self.keyword_subjects[keyword]:
+                continue
+            self.keyword_subjects[keyword].append(subject)
+            self.exact[keyword][subject] += STATIC_WEIGHT
+            self.automaton.add(keyword)
+            for start in range(len(keyword)):
+                for end in range(start + 1, len(keyword) + 1):
+                    self.substrings[keyword[start:end]].add(keyword)
+            changed = True
+        if changed:
+            # Partial matches can change for any word
+            self._term_cache.clear()
+            self._reset_term_matrix(self._matrix_subjects)
+
+    def remove_keywords(self, subject: str, keywords: Iterable[str]):
+        """Unregister static keywords of a subject"""
+        changed = False
+        unused = []
+        for keyword in keywords:
+            subjects = self.keyword_subjects.get(keyword)
+            if not subjects or subject not in subjects:
+                continue
+            subjects.remove(subject)
+            weights = self.exact[keyword]
+            weights[subject] -= STATIC_WEIGHT
+            if not weights[subject]:
+                del weights[subject]
+            if not subjects:
+                # No subject lists it any more, so it no longer matches partially either
+                del self.keyword_subjects[keyword]
+                unused.append(keyword)
+                for start in range(len(keyword)):
+                    for end in range(start + 1, len(keyword) + 1):
+                        holders = self.substrings.get(keyword[start:end])
+                        if holders is not None:
+                            holders.discard(keyword)
+                            if not holders:
+                                del self.substrings[keyword[start:end]]
+            changed = True
+        if unused:
+            self.automaton.discard(unused)
+        if changed:
+            self._term_cache.clear()
+            self._reset_term_matrix(self._matrix_subjects)
+
+    def add_dynamic(self, subject: str, keyword: str):
+        if keyword in self.dynamic[subject]:
+            return
+        self.dynamic[subject].add(keyword)
+        self.exact[keyword][subject] += DYNAMIC_WEIGHT
+        self._term_changed(keyword)
+
+    def discard_dynamic(self, subject: str, keyword: str):
+        if keyword not in self.dynamic[subject]:
+            return
+        self.dynamic[subject].discard(keyword)
+        weights = self.exact[keyword]
+        weights[subject] -= DYNAMIC_WEIGHT
+        if not weights[subject]:
+            del weights[subject]
+        self._term_changed(keyword)
+
+    def _term_changed(self, word: str):
+        self._term_cache.pop(word, None)
+        row = self._matrix_rows.get(word)
+        if row is not None:
+            self._matrix[row] = self._term_vector(word)
+
+    def term_weights(self, word: str) -> Dict[str, int]:
+        """Return the per-subject score contributed by a single word"""
+        cached = self._term_cache.get(word)
+        if cached is not None:
+            return cached
+        with self._lock:
+            return self._compute_term_weights(word)
+
+    def _compute_term_weights(self, word: str) -> Dict[str, int]:
+        weights = defaultdict(int)
+        for subject, weight in self.exact.get(word, {}).items():
+            weights[subject] += weight
+        for keyword in self.substrings.get(word, set()) | self.automaton.find(word):
+            for subject in self.keyword_subjects[keyword]:
+                weights[subject] += PARTIAL_WEIGHT
+        weights = dict(weights)
+        if len(self._term_cache) >= self.TERM_CACHE_SIZE:
+            self._term_cache.clear()
+        self._term_cache[word] = weights
+        return weights
+
+    def score(self, words: List[str], subjects: Iterable[str]) -> Dict[str, float]:
+        """Sum the keyword scores of words for each of the given subjects"""
+        scores = {subject: 0 for subject in subjects}
+        for word in words:
+            for subject, weight in self.term_weights(word).items():
+                if subject in scores:
+                    scores[subject] += weight
+        return scores
+
+    def _reset_term_matrix(self, subjects: Sequence[str]):
+        self._matrix_subjects = tuple(subjects)
+        self._matrix_columns = {subject: column for column, subject in enumerate(self._matrix_subjects)}
+        self._matrix_rows = {}
+        self._matrix = np.zeros((64, len(self._matrix_subjects)))
+
+    def _term_vector(self, word: str) -> np.ndarray:
+        vector = np.zeros(len(self._matrix_subjects))
+        for subject, weight in self.term_weights(word).items():
+            column = self._matrix_columns.get(subject)
+            if column is not None:
+                vector[column] = weight
+        return vector
+
+    def _term_row(self, word: str) -> int:
+        """Return the term x subject matrix row for word, compiling it on first use"""
+        row = self._matrix_rows.get(word)
+        if row is None:
+            row = len(self._matrix_rows)
+            if row == len(self._matrix):
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            self._matrix[row] = self._term_vector(word)
+            self._matrix_rows[word] = row
+        return row
+
+    def score_batch(self, documents: Sequence[List[str]], subjects: Sequence[str]) -> np.ndarray:
+        """Score tokenized documents against subjects in one matrix product.
+
+        The documents form a sparse document-term matrix in CSR layout (one
+        column index per token occurrence); each row is reduced over the
+        matching rows of the cached term x subject weight matrix, which gives
+        the same sums as score() for every document.
+        """
+        with self._lock:
+            if tuple(subjects) != self._matrix_subjects:
+                self._reset_term_matrix(subjects)
+            columns = []
+            indptr = [0]
+            for words in documents:
+                columns.extend(self._term_row(word) for word in words)
+                indptr.append(len(columns))
+            matrix = self._matrix
+
+        scores = np.zeros((len(documents), matrix.shape[1]))
+        if not columns:
+            return scores
+        indptr = np.asarray(indptr)
+        starts = indptr[:-1]
+        non_empty = indptr[1:] > starts
+        gathered = matrix[np.asarray(columns)]
+        scores[non_empty] = np.add.reduceat(gathered, starts[non_empty], axis=0)
+        return scores
@@ -0,0 +1,83 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+
+class RWLock:
+    """Reader/writer lock with writer preference.
+
+    Any number of threads may hold the read lock at once; the write lock is
+    exclusive. New readers wait while a writer is waiting, so a steady stream
+    of lookups cannot starve learning. Both locks are reentrant and the
+    writing thread may also take the read lock. A thread holding only the
+    read lock cannot upgrade to the write lock (two upgraders would deadlock)
+    and gets a RuntimeError instead.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, 'reads', 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.reads = depth + 1
+            try:
+                yield
+            finally:
+                self._local.reads = depth
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: self._writer is None and not self._waiting_writers)
+            self._readers += 1
+        self._local.reads = 1
+        try:
+            yield
+        finally:
+            self._local.reads = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            yield
+            return
+        if getattr(self._local, 'reads', 0):
+            raise RuntimeError("cannot upgrade a read lock to a write lock")
+        with self._cond:
+            self._waiting_writers += 1
+            self._cond.wait_for(lambda: self._writer is None and not self._readers)
+            self._waiting_writers -= 1
+            self._writer = me
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
+
+def read_locked(method):
+    """Run a method under its instance's ``lock.read()``"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.read():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def write_locked(method):
+    """Run a method under its instance's ``lock.write()``"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.write():
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -1,26 +1,79 @@
 import re
 import random
-import json
 import os
 import numpy as np
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+from collections import defaultdict
+import heapq
 import math
-from typing import Dict, List, Tuple, Optional
-import google.generativeai as genai
+from typing import Dict, Iterator, List, Set, Tuple, Optional
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aggregates import RunningStats
+from analysis import RequestAnalysis, question_keywords
+from answer_cache import AnswerCache, fold_prompt
+from bounded import StateLimits, age_counts, append_bounded, lowest, slack
+from classifier import SubjectMatcher
+from concurrency import RWLock, read_locked, write_locked
+from llm import LLMError, default_client
+from persistence import BackgroundWriter, JournalStore
+from sessions import SessionState, SessionTable
+from singleflight import SingleFlight
+from sqlite_store import SQLiteStore
+from text_index import KnowledgeIndex, NearDuplicateIndex, SemanticIndex, TokenIndex, tokenize_text
+from training import TrainingPool
 
 class EnhancedLearningQABot:
-    def __init__(self):
+    def __init__(self, data_file='enhanced_qa_ml_data.json', compact_every=1000, storage=None, save_interval=1.0, llm=None,
+                 answer_cache=None, sync_interval=None, limits=None):
         self.name = "Liam"
+        # Lookups share the read lock; every mutation goes through record_change or a
+        # write-locked method, so a single thread changes state at a time
+        self.lock = RWLock()
+        # Shared per process so the model handle is configured once
+        self.llm = llm or default_client()
+        # Local answers below this confidence (0-100) fall through to Gemini in answer_tiered
+        self.min_confidence = float(os.getenv('LIAM_MIN_CONFIDENCE', 30))
+        # answer_tiered serves a learned answer only to a question at least this similar (0-1) to the one it
+        # answered; unrated answers weigh 1.0, so min_confidence alone lets through the 0.4 near-misses chat accepts
+        self.learned_similarity = float(os.getenv('LIAM_LEARNED_SIMILARITY', 0.7))
+        # Caps that keep memory and snapshot size steady regardless of uptime
+        self.limits = limits or StateLimits.from_env()
+        # Normalized prompt -> Gemini answer, persisted next to the learning data
+        self.answer_cache = answer_cache or AnswerCache(
+            os.path.splitext(data_file)[0] + '_answers.json',
+            max_entries=int(os.getenv('LIAM_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('LIAM_CACHE_TTL', 7 * 24 * 3600)),
+            near_duplicate_threshold=float(os.getenv('LIAM_CACHE_NEAR_DUPLICATE', 0)) or None,
+            save_interval=save_interval)
+        # Per-user context and last answer; requests without a session id (and chat()) share the default one
+        self.sessions = SessionTable(
+            max_sessions=int(os.getenv('LIAM_MAX_SESSIONS', 100000)),
+            ttl=float(os.getenv('LIAM_SESSION_TTL', 1800)),
+            context_size=int(os.getenv('LIAM_SESSION_CONTEXT', 10)))
+        self.default_session = SessionState('default', self.sessions.context_size)
+        # Concurrent requests for the same prompt share one Gemini call
+        self.gemini_flight = SingleFlight()
+        # Background Gemini training for questions answered locally, within the Gemini quota
+        self.training = TrainingPool(
+            self.train_from_gemini,
+            workers=int(os.getenv('LIAM_TRAIN_WORKERS', 2)),
+            max_queue=int(os.getenv('LIAM_TRAIN_QUEUE', 100)),
+            requests_per_minute=float(os.getenv('LIAM_GEMINI_RPM', 60)))
+        # 'json' keeps a snapshot + change journal; 'sqlite' adds uncapped history with full-text search
+        storage = storage or os.getenv('LIAM_STORAGE', 'json')
+        if storage == 'sqlite':
+            self.store = SQLiteStore(os.path.splitext(data_file)[0] + '.db', compact_every=compact_every)
+        else:
+            self.store = JournalStore(data_file, compact_every=compact_every)
         self.conversation_history = []
         self.word_frequencies = defaultdict(int)
-        self.response_feedback = defaultdict(list)
+        self.aggregates = RunningStats()  # Question and feedback totals behind the dashboards
         self.subject_expertise = defaultdict(int)
         self.question_patterns = {}
         self.knowledge_base = {}
         self.learned_responses = defaultdict(list)  # New: Store learned responses
-        self.context_memory = []  # New: Remember conversation context
         self.user_preferences = {}  # New: Learn user preferences
         self.question_similarity_cache = {}  # New: Cache similar questions
         self.dynamic_keywords = defaultdict(set)  # New: Learn new keywords
@@ -28,6 +81,12 @@ class EnhancedLearningQABot:
         self.correction_memory = defaultdict(list)  # New: Remember corrections
         self.success_patterns = defaultdict(list)  # New: Remember successful responses
         self.all_keywords = set()  # New: Store all unique keywords
+        self.history_index = TokenIndex()  # Token -> conversation_history positions
+        self.learned_index = defaultdict(NearDuplicateIndex)  # Per-subject MinHash/LSH over learned questions
+        # Hashed TF-IDF vectors of every learned question, for paraphrases the word overlap misses
+        self.semantic_index = SemanticIndex(int(os.getenv('LIAM_EMBEDDING_DIM', 512)))
+        self.semantic_threshold = float(os.getenv('LIAM_SEMANTIC_THRESHOLD', 0.55))
+        self.knowledge_index = KnowledgeIndex()  # Flat, lowercased knowledge base tables
         
         # Initialize comprehensive knowledge base
         self.initialize_knowledge_base()
@@ -50,8 +109,21 @@ class EnhancedLearningQABot:
             'language': {'language', 'grammar', 'vocabulary', 'translate', 'pronunciation', 'dialect', 'linguistics', 'communication', 'speech', 'writing', 'meaning', 'word', 'sentence'}
         }
         
+        # The built-in keywords above; only promoted ones are dropped past the cap
+        self.seed_keywords = {subject: frozenset(keywords) for subject, keywords in self.subject_keywords.items()}
+        self.subject_matcher = SubjectMatcher()  # Compiled form of subject/dynamic keywords
+        
         # Load saved data
         self.load_ml_data()
+        # Disk writes happen on a background thread, at most once per save_interval
+        self.writer = BackgroundWriter(self.store, interval=save_interval)
+        # Other worker processes sharing the data file are picked up every sync_interval seconds (0 disables)
+        self.sync_interval = float(os.getenv('LIAM_SYNC_INTERVAL', 1.0)) if sync_interval is None else sync_interval
+        self._stop_sync = threading.Event()
+        self._sync_thread = None
+        if self.sync_interval > 0:
+            self._sync_thread = threading.Thread(target=self._sync_loop, name='liam-sync', daemon=True)
+            self._sync_thread.start()
     
     def initialize_knowledge_base(self):
         """Initialize comprehensive knowledge base across subjects"""
@@ -158,44 +230,114 @@ class EnhancedLearningQABot:
                 'oop': 'Object-Oriented Programming (OOP) is a paradigm based on objects and classes. It helps organize code and promote reuse.'
             }
         }
+        self.compile_knowledge_base()
+    
+    def compile_knowledge_base(self):
+        """Rebuild the flat search tables; call after changing knowledge_base"""
+        self.knowledge_index.compile(self.knowledge_base)
     
+    @read_locked
     def save_ml_data(self):
         """Save enhanced machine learning data"""
         try:
-            ml_data = {
-                'word_frequencies': dict(self.word_frequencies),
-                'response_feedback': dict(self.response_feedback),
-                'subject_expertise': dict(self.subject_expertise),
-                'question_patterns': self.question_patterns,
-                'conversation_history': self.conversation_history[-100:],  # Keep more history
-                'learned_responses': dict(self.learned_responses),
-                'context_memory': self.context_memory[-50:],
-                'user_preferences': self.user_preferences,
-                'question_similarity_cache': self.question_similarity_cache,
-                'dynamic_keywords': {k: list(v) for k, v in self.dynamic_keywords.items()},
-                'response_templates': dict(self.response_templates),
-                'correction_memory': dict(self.correction_memory),
-                'success_patterns': dict(self.success_patterns),
-                'all_keywords': list(self.all_keywords)  # New: Save all keywords
-            }
-            with open('enhanced_qa_ml_data.json', 'w') as f:
-                json.dump(ml_data, f, indent=2)
+            self.writer.compact(self.ml_state())
         except Exception as e:
             print(f"Error saving data: {e}")
     
+    @read_locked
+    def ml_state(self) -> Dict:
+        """The learning state as saved in a snapshot"""
+        return {
+            'word_frequencies': dict(self.word_frequencies),
+            'aggregates': self.aggregates.to_dict(),
+            'subject_expertise': dict(self.subject_expertise),
+            'question_patterns': self.question_patterns,
+            'conversation_history': self.conversation_history[-100:],  # Keep more history
+            'learned_responses': dict(self.learned_responses),
+            'user_preferences': self.user_preferences,
+            'question_similarity_cache': self.question_similarity_cache,
+            'dynamic_keywords': {k: list(v) for k, v in self.dynamic_keywords.items()},
+            'response_templates': dict(self.response_templates),
+            'correction_memory': dict(self.correction_memory),
+            'success_patterns': dict(self.success_patterns),
+            'all_keywords': list(self.all_keywords),  # New: Save all keywords
+            'subject_keywords': {k: list(v) for k, v in self.subject_keywords.items()}
+        }
+    
+    @read_locked
+    def stats(self) -> Dict:
+        """Dashboard numbers from the running aggregates; the cost does not grow with history"""
+        return dict(self.aggregates.summary(),
+                    expertise=dict(self.subject_expertise),
+                    learned_responses=sum(len(items) for items in self.learned_responses.values()),
+                    sessions=self.sessions.stats(),
+                    training=self.training.stats(),
+                    gemini=self.gemini_flight.stats(),
+                    persistence=self.persistence_stats())
+    
+    def persistence_stats(self) -> Dict:
+        """Background writer health: pending work and the duration of the last write"""
+        return {
+            'pending_saves': self.writer.pending_saves,
+            'last_save_latency': self.writer.last_save_latency,
+            'saves': self.writer.saves
+        }
+    
+    def close(self):
+        """Drain background training, flush buffered changes to disk and stop the threads"""
+        self.training.close(timeout=float(os.getenv('LIAM_TRAIN_DRAIN_TIMEOUT', 30)))
+        self._stop_sync.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        self.writer.close()
+        self.answer_cache.close()
+    
+    def sync(self):
+        """Apply the changes other worker processes have saved since the last sync.
+        
+        If another worker has compacted the store in the meantime, everything
+        is reloaded from disk instead.
+        """
+        self.answer_cache.sync()
+        with self.lock.write():
+            records = self.store.poll()
+            if records is None:
+                # Our buffered changes must be on disk before it is re-read
+                self.writer.flush()
+                self.load_ml_data()
+                return
+            for change in records:
+                try:
+                    self.apply_change(change)
+                except Exception as e:
+                    print(f"Error applying change {change.get('op')}: {e}")
+    
+    def _sync_loop(self):
+        while not self._stop_sync.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error syncing data: {e}")
+    
     def load_ml_data(self):
-        """Load enhanced machine learning data"""
+        """Load enhanced machine learning data: the last snapshot plus the journal since"""
+        records = []
         try:
-            if os.path.exists('enhanced_qa_ml_data.json'):
-                with open('enhanced_qa_ml_data.json', 'r') as f:
-                    ml_data = json.load(f)
+            ml_data, records = self.store.load()
+            if ml_data:
                 self.word_frequencies = defaultdict(int, ml_data.get('word_frequencies', {}))
-                self.response_feedback = defaultdict(list, ml_data.get('response_feedback', {}))
                 self.subject_expertise = defaultdict(int, ml_data.get('subject_expertise', {}))
-                self.question_patterns = ml_data.get('question_patterns', {})
+                # Older snapshots kept every occurrence of a pattern as a record
+                self.question_patterns = {key: self.summarize_pattern(value) if isinstance(value, list) else value
+                                          for key, value in ml_data.get('question_patterns', {}).items()}
                 self.conversation_history = ml_data.get('conversation_history', [])
+                if 'aggregates' in ml_data:
+                    self.aggregates = RunningStats.from_dict(ml_data['aggregates'])
+                elif 'word_frequencies' in ml_data:
+                    # Saved before the aggregates existed; seed them from what was kept
+                    self.aggregates = RunningStats.from_history(self.conversation_history,
+                                                                ml_data.get('response_feedback', {}))
                 self.learned_responses = defaultdict(list, ml_data.get('learned_responses', {}))
-                self.context_memory = ml_data.get('context_memory', [])
                 self.user_preferences = ml_data.get('user_preferences', {})
                 self.question_similarity_cache = ml_data.get('question_similarity_cache', {})
                 
@@ -209,24 +351,301 @@ class EnhancedLearningQABot:
                 self.correction_memory = defaultdict(list, ml_data.get('correction_memory', {}))
                 self.success_patterns = defaultdict(list, ml_data.get('success_patterns', {}))
                 self.all_keywords = set(ml_data.get('all_keywords', []))  # New: Load all keywords
+                
+                # Promoted keywords extend the built-in ones
+                for k, v in ml_data.get('subject_keywords', {}).items():
+                    self.subject_keywords.setdefault(k, set()).update(v)
         except Exception as e:
             print(f"Error loading data: {e}")
+        self.enforce_limits()
+        self.rebuild_history_index()
+        self.rebuild_learned_index()
+        self.subject_matcher.rebuild(self.subject_keywords, self.dynamic_keywords)
+        self.knowledge_index.set_success_counts({key: len(items) for key, items in self.success_patterns.items()})
+        
+        # Replay changes made since the snapshot
+        for change in records:
+            try:
+                self.apply_change(change)
+            except Exception as e:
+                print(f"Error replaying change {change.get('op')}: {e}")
+    
+    def rebuild_history_index(self):
+        """Re-index every question in conversation_history"""
+        self.history_index.clear()
+        for position, conv in enumerate(self.conversation_history):
+            self.history_index.add(position, tokenize_text(conv['question']))
+    
+    def rebuild_learned_index(self):
+        """Re-index every learned question, per subject"""
+        self.learned_index.clear()
+        self.semantic_index.clear()
+        for subject, items in self.learned_responses.items():
+            for item in items:
+                self.learned_index[subject].add(item)
+                self.semantic_index.add(item, subject)
+    
+    @write_locked
+    def add_learned_response(self, subject: str, item: Dict):
+        """Append a learned response and index its question, forgetting the weakest beyond the cap"""
+        self.record_change('learned_added', subject=subject, item=item)
+        forgotten = self._forgotten_learned(subject)
+        if forgotten:
+            self.record_learned_removed(subject, forgotten)
+    
+    def record_learned_removed(self, subject: str, positions: List[int]):
+        """Remove the learned responses at positions, identified by question and learned date for other workers"""
+        self.record_change(**self.learned_removal(subject, positions))
+    
+    def learned_removal(self, subject: str, positions: List[int]) -> Dict:
+        items = [self.learned_responses[subject][position] for position in positions]
+        return {'op': 'learned_removed', 'subject': subject, 'indices': positions,
+                'questions': [item['question'] for item in items],
+                'dates': [item.get('learned_date') for item in items]}
+    
+    def _forgotten_learned(self, subject: str) -> List[int]:
+        """Positions of the learned responses to forget once a subject is over the cap.
+
+        User-taught answers are kept; the rest go lowest rated and least used first.
+        """
+        items = self.learned_responses[subject]
+        if not self.limits.learned or len(items) <= self.limits.learned:
+            return []
+        candidates = [position for position, item in enumerate(items) if not item.get('user_taught')]
+        return sorted(lowest(candidates, lambda position: (items[position]['avg_feedback'], items[position]['usage_count']),
+                             self.limits.learned, len(items)))
+    
+    @write_locked
+    def record_change(self, op: str, **fields):
+        """Apply a state change and append it to the journal"""
+        change = dict(fields, op=op)
+        self.apply_change(change)
+        try:
+            self.writer.append(change)
+            if self.writer.needs_compaction:
+                self.save_ml_data()
+        except Exception as e:
+            print(f"Error saving data: {e}")
+    
+    def apply_change(self, change: Dict):
+        """Apply one journaled change; used both live and when replaying the journal"""
+        op = change['op']
+        if op == 'observe':
+            for token in change['tokens']:
+                self.word_frequencies[token] += 1
+            age_counts(self.word_frequencies, self.limits.vocabulary)
+        elif op == 'context':
+            # Context is now kept per session, in memory only; older journals may still hold these
+            pass
+        elif op == 'pattern':
+            record = change['record']
+            # Re-inserted so the dict stays ordered from least to most recently seen
+            pattern = self.question_patterns.pop(change['key'], None) or {'count': 0, 'first_seen': record['timestamp']}
+            pattern['count'] += 1
+            pattern['last_seen'] = record['timestamp']
+            pattern['from'], pattern['to'] = record['from'], record['to']
+            self.question_patterns[change['key']] = pattern
+            self._trim_patterns()
+        elif op == 'dynamic_keywords':
+            subject = change['subject']
+            # Ensure 'general' is always present in subject_keywords
+            self.subject_keywords.setdefault('general', set())
+            self.subject_keywords.setdefault(subject, set())
+            for keyword in change['keywords']:
+                self.dynamic_keywords[subject].add(keyword)
+                self.subject_matcher.add_dynamic(subject, keyword)
+            self._trim_dynamic_keywords(subject)
+        elif op == 'keyword_promoted':
+            subject = change['subject']
+            self.subject_keywords.setdefault(subject, set()).update(change['keywords'])
+            self.subject_matcher.add_keywords(subject, change['keywords'])
+            # Remove learned keywords from dynamic set
+            for keyword in change['discarded']:
+                self.dynamic_keywords[subject].discard(keyword)
+                self.subject_matcher.discard_dynamic(subject, keyword)
+        elif op == 'keywords_demoted':
+            subject = change['subject']
+            self.subject_keywords.get(subject, set()).difference_update(change['keywords'])
+            self.subject_matcher.remove_keywords(subject, change['keywords'])
+        elif op == 'asked':
+            self.subject_expertise[change['subject']] += 1
+            self.aggregates.record_question(change['subject'], change['keywords'])
+        elif op == 'expertise':
+            subject = change['subject']
+            self.subject_expertise[subject] = max(0, self.subject_expertise[subject] + change['delta'])
+        elif op == 'keywords':
+            self.all_keywords.update(change['keywords'])
+            self._trim_keywords()
+        elif op == 'success':
+            if not append_bounded(self.success_patterns[change['key']], change['record'], change.get('keep')):
+                # Past the cap the count, and so the knowledge base boost, stays put
+                self.knowledge_index.record_success(change['key'])
+        elif op == 'history':
+            self.conversation_history.append(change['entry'])
+            self.history_index.add(len(self.conversation_history) - 1, tokenize_text(change['entry']['question']))
+            self._trim_history()
+        elif op == 'feedback':
+            self.aggregates.record_feedback(change['subject'], change['rating'])
+        elif op == 'history_feedback':
+            position = self._history_position(change)
+            if position is not None:
+                self.conversation_history[position]['feedback'] = change['rating']
+        elif op == 'learned_added':
+            item = change['item']
+            self.learned_responses[change['subject']].append(item)
+            self.learned_index[change['subject']].add(item)
+            self.semantic_index.add(item, change['subject'])
+        elif op == 'learned_rated':
+            items = self.learned_responses[change['subject']]
+            position = change['index']
+            if 'question' in change and (position >= len(items) or items[position]['question'] != change['question']):
+                # Another worker's list may be ordered differently
+                position = next((i for i, item in enumerate(items) if item['question'] == change['question']), None)
+                if position is None:
+                    return
+            item = items[position]
+            append_bounded(item['feedback_scores'], change['rating'], change.get('keep'))
+            item['avg_feedback'] = np.mean(item['feedback_scores'])
+            item['usage_count'] += 1
+        elif op == 'learned_removed':
+            items = self.learned_responses[change['subject']]
+            self.learned_responses[change['subject']] = self._remove_positions(
+                items, self._removed_positions(items, change), self.learned_index[change['subject']], self.semantic_index)
+        elif op == 'template':
+            append_bounded(self.response_templates[change['subject']], change['template'], change.get('keep'))
+        elif op == 'correction':
+            append_bounded(self.correction_memory[change['subject']], change['record'], change.get('keep'))
+        elif op == 'corrections_removed':
+            items = self.correction_memory[change['subject']]
+            self.correction_memory[change['subject']] = self._remove_positions(
+                items, self._removed_positions(items, change))
+        elif op == 'preference':
+            key = change['key']
+            if 'fields' in change:
+                if key not in self.user_preferences:
+                    self.user_preferences[key] = {'detailed': 0, 'concise': 0, 'examples': 0}
+                for field in change['fields']:
+                    self.user_preferences[key][field] += 1
+            else:
+                self.user_preferences[key] = self.user_preferences.get(key, 0) + change['delta']
+                self._trim_preferences()
+        else:
+            raise ValueError(f"Unknown change: {op}")
+    
+    def _trim_patterns(self):
+        """Forget the least recently seen conversation patterns beyond the cap"""
+        limit = self.limits.patterns
+        if limit and len(self.question_patterns) > limit:
+            for key in list(self.question_patterns)[:len(self.question_patterns) - slack(limit)]:
+                del self.question_patterns[key]
+    
+    def _trim_dynamic_keywords(self, subject: str):
+        """Forget a subject's least frequent dynamic keywords beyond the cap"""
+        keywords = self.dynamic_keywords[subject]
+        for keyword in lowest(keywords, lambda k: self.word_frequencies.get(k, 0),
+                              self.limits.dynamic_keywords, len(keywords)):
+            keywords.discard(keyword)
+            self.subject_matcher.discard_dynamic(subject, keyword)
+    
+    def _trim_keywords(self):
+        """Forget the least frequent keywords beyond the cap"""
+        for keyword in lowest(self.all_keywords, lambda k: self.word_frequencies.get(k, 0),
+                              self.limits.keywords, len(self.all_keywords)):
+            self.all_keywords.discard(keyword)
+    
+    def _trim_preferences(self):
+        """Forget the weakest keyword preferences beyond the cap; style counters are kept"""
+        keys = [key for key in self.user_preferences if key.startswith('keyword_')]
+        for key in lowest(keys, lambda k: abs(self.user_preferences[k]), self.limits.preferences, len(keys)):
+            del self.user_preferences[key]
+    
+    def _trim_history(self):
+        """Drop the oldest conversation history beyond the cap"""
+        limit = self.limits.history
+        if limit and len(self.conversation_history) > limit:
+            del self.conversation_history[:len(self.conversation_history) - slack(limit)]
+            self.rebuild_history_index()
+    
+    def enforce_limits(self):
+        """Bring state loaded from an older, unbounded snapshot within the limits"""
+        limits = self.limits
+        for lists, keep in ((self.response_templates, limits.templates),
+                            (self.correction_memory, limits.corrections),
+                            (self.success_patterns, limits.success_records)):
+            for items in lists.values():
+                if keep and len(items) > keep:
+                    del items[:len(items) - keep]
+        age_counts(self.word_frequencies, limits.vocabulary)
+        for subject in list(self.dynamic_keywords):
+            self._trim_dynamic_keywords(subject)
+        for subject, keywords in self.subject_keywords.items():
+            keywords.difference_update(self._demoted_keywords(subject))
+        for subject in list(self.learned_responses):
+            forgotten = self._forgotten_learned(subject)
+            if forgotten:
+                change = self.learned_removal(subject, forgotten)
+                self.apply_change(change)
+                # Journaled so the SQLite learned table drops the same rows; the background
+                # writer does not exist yet on the first load
+                self.store.append(dict(change, origin=self.store.origin))
+        self._trim_patterns()
+        self._trim_keywords()
+        self._trim_preferences()
+        if limits.history and len(self.conversation_history) > limits.history:
+            del self.conversation_history[:len(self.conversation_history) - limits.history]
+    
+    def _history_position(self, change: Dict) -> Optional[int]:
+        """The history entry a change refers to: the latest one with its question.
+        
+        Changes journaled without a question refer to the last entry. None if
+        there is no such entry (answers from the learned and Gemini tiers are
+        not in the history).
+        """
+        if not self.conversation_history:
+            return None
+        question = change.get('question')
+        if question is None:
+            return -1
+        for position in range(len(self.conversation_history) - 1, -1, -1):
+            if self.conversation_history[position]['question'] == question:
+                return position
+        return None
+    
+    @staticmethod
+    def _removed_positions(items: List[Dict], change: Dict) -> List[int]:
+        """Positions a removal refers to: by question and learned date, by question, or the journaled indices"""
+        if 'questions' not in change:
+            return change['indices']
+        if 'dates' in change:
+            # Learned responses can share a question, e.g. a user-taught answer and one from Gemini
+            keys = set(zip(change['questions'], change['dates']))
+            return [position for position, item in enumerate(items) if (item['question'], item.get('learned_date')) in keys]
+        questions = set(change['questions'])
+        return [position for position, item in enumerate(items) if item['question'] in questions]
+    
+    @staticmethod
+    def _remove_positions(items: List, indices: List[int], *indexes) -> List:
+        """Return items without the given positions, dropping them from the indexes too"""
+        removed = set(indices)
+        for index in indexes:
+            for position in removed:
+                index.remove(items[position])
+        return [item for position, item in enumerate(items) if position not in removed]
     
     def tokenize(self, text):
         """Advanced tokenization with better preprocessing"""
-        text = re.sub(r'[^\w\s\?\!]', ' ', text.lower())
-        tokens = [word for word in text.split() if len(word) > 2]
-        
-        # Update word frequencies for learning
-        for token in tokens:
-            self.word_frequencies[token] += 1
-        
-        return tokens
+        return list(tokenize_text(text))
+    
+    def observe_question(self, question, analysis: Optional[RequestAnalysis] = None):
+        """Update word frequencies for learning, once per incoming question"""
+        tokens = analysis.tokens if analysis else tokenize_text(question)
+        if tokens:
+            self.record_change('observe', tokens=list(tokens))
     
     def calculate_text_similarity(self, text1: str, text2: str) -> float:
         """Calculate similarity between two texts using word overlap"""
-        tokens1 = set(self.tokenize(text1))
-        tokens2 = set(self.tokenize(text2))
+        tokens1 = set(tokenize_text(text1))
+        tokens2 = set(tokenize_text(text2))
         
         if not tokens1 or not tokens2:
             return 0.0
@@ -236,123 +655,173 @@ class EnhancedLearningQABot:
         
         return len(intersection) / len(union)
     
-    def find_similar_questions(self, question: str, threshold: float = 0.3) -> List[Dict]:
+    @read_locked
+    def find_similar_questions(self, question: str, threshold: float = 0.3, top_k: Optional[int] = None,
+                               analysis: Optional[RequestAnalysis] = None) -> List[Dict]:
         """Find similar questions from conversation history"""
         similar_questions = []
+        tokens = analysis.tokens if analysis else tokenize_text(question)
+        
+        if isinstance(self.store, SQLiteStore):
+            # Search the whole stored history, plus the recent entries the background writer has not flushed yet
+            recent = [(self.conversation_history[position], similarity) for position, similarity
+                      in self.history_index.query(tokens, threshold, top_k)]
+            seen = {(entry.get('timestamp'), entry['question']) for entry, _ in recent}
+            stored = [(entry, similarity)
+                      for entry, similarity in self.store.similar_history(question, threshold, top_k, tokens)
+                      if (entry.get('timestamp'), entry['question']) not in seen]
+            matches = sorted(stored + recent, key=lambda match: -match[1])[:top_k]
+        else:
+            matches = [(self.conversation_history[position], similarity) for position, similarity
+                       in self.history_index.query(tokens, threshold, top_k)]
+        for conv, similarity in matches:
+            similar_questions.append({
+                'question': conv['question'],
+                'response': conv['response'],
+                'similarity': similarity,
+                'feedback': conv.get('feedback', 0),
+                'subject': conv.get('subject', 'general')
+            })
         
-        for conv in self.conversation_history:
-            similarity = self.calculate_text_similarity(question, conv['question'])
-            if similarity >= threshold:
-                similar_questions.append({
-                    'question': conv['question'],
-                    'response': conv['response'],
-                    'similarity': similarity,
-                    'feedback': conv.get('feedback', 0),
-                    'subject': conv.get('subject', 'general')
-                })
-        
-        return sorted(similar_questions, key=lambda x: x['similarity'], reverse=True)
+        return similar_questions
+    
+    def session(self, session: Optional[SessionState] = None) -> SessionState:
+        """The given session, or the default one shared by callers without a session"""
+        return session or self.default_session
     
-    def learn_from_context(self, current_question: str):
+    @write_locked
+    def learn_from_context(self, current_question: str, subject: str, session: Optional[SessionState] = None,
+                           analysis: Optional[RequestAnalysis] = None):
         """Learn from conversation context"""
-        if len(self.context_memory) > 0:
-            # Add current question to context
-            self.context_memory.append({
-                'question': current_question,
-                'timestamp': datetime.now().isoformat(),
-                'tokens': self.tokenize(current_question)
+        session = self.session(session)
+        # Add current question to the session's context
+        session.add_context(current_question, subject)
+        
+        # Learn patterns from context
+        if len(session.context) >= 2:
+            self.identify_conversation_patterns(session, analysis)
+    
+    def identify_conversation_patterns(self, session: SessionState, analysis: Optional[RequestAnalysis] = None):
+        """Identify a pattern in the session's newest topic transition.
+        
+        Earlier transitions were looked at when they were the newest.
+        """
+        (previous_question, _), (question, _) = session.context[-2:]
+        
+        # Find common themes
+        token_set = analysis.token_set if analysis else frozenset(tokenize_text(question))
+        common_tokens = token_set.intersection(tokenize_text(previous_question))
+        if len(common_tokens) > 1:
+            pattern_key = '-'.join(sorted(common_tokens)[:3])
+            self.record_change('pattern', key=pattern_key, record={
+                'from': previous_question,
+                'to': question,
+                'timestamp': datetime.now().isoformat()
             })
-            
-            # Keep only recent context (last 10 interactions)
-            self.context_memory = self.context_memory[-10:]
-            
-            # Learn patterns from context
-            if len(self.context_memory) >= 2:
-                self.identify_conversation_patterns()
     
-    def identify_conversation_patterns(self):
-        """Identify patterns in conversation flow"""
-        if len(self.context_memory) < 2:
-            return
-        
-        # Look for topic transitions
-        for i in range(1, len(self.context_memory)):
-            prev_tokens = set(self.context_memory[i-1]['tokens'])
-            curr_tokens = set(self.context_memory[i]['tokens'])
-            
-            # Find common themes
-            common_tokens = prev_tokens.intersection(curr_tokens)
-            if len(common_tokens) > 1:
-                pattern_key = '-'.join(sorted(common_tokens)[:3])
-                if pattern_key not in self.question_patterns:
-                    self.question_patterns[pattern_key] = []
-                self.question_patterns[pattern_key].append({
-                    'from': self.context_memory[i-1]['question'],
-                    'to': self.context_memory[i]['question'],
-                    'timestamp': datetime.now().isoformat()
-                })
+    @staticmethod
+    def summarize_pattern(records: List[Dict]) -> Dict:
+        """Counter form of a pattern's occurrence records, keeping the latest example"""
+        return {'count': len(records), 'first_seen': records[0]['timestamp'], 'last_seen': records[-1]['timestamp'],
+                'from': records[-1]['from'], 'to': records[-1]['to']}
+    
+    @read_locked
+    def top_transitions(self, k: int = 5) -> List[Dict]:
+        """The k most frequent topic transitions, most recently seen first among equal counts"""
+        top = heapq.nlargest(k, self.question_patterns.items(),
+                             key=lambda item: (item[1]['count'], item[1]['last_seen']))
+        return [{'pattern': key, **pattern} for key, pattern in top]
     
-    def learn_dynamic_keywords(self, question: str, subject: str):
+    @write_locked
+    def learn_dynamic_keywords(self, question: str, subject: str, analysis: Optional[RequestAnalysis] = None):
         """Learn new keywords for subjects from questions"""
-        tokens = self.tokenize(question)
+        tokens = analysis.tokens if analysis else tokenize_text(question)
         
-        # Ensure 'general' is always present in subject_keywords
-        if 'general' not in self.subject_keywords:
-            self.subject_keywords['general'] = set()
         # Add new keywords to subject, handle missing subject gracefully
-        if subject not in self.subject_keywords:
-            self.subject_keywords[subject] = set()
-        for token in tokens:
-            if token not in self.subject_keywords[subject]:
-                self.dynamic_keywords[subject].add(token)
+        known = self.subject_keywords.get(subject, set())
+        new_keywords = [token for token in dict.fromkeys(tokens)
+                        if token not in known and token not in self.dynamic_keywords[subject]]
+        if new_keywords or 'general' not in self.subject_keywords or subject not in self.subject_keywords:
+            self.record_change('dynamic_keywords', subject=subject, keywords=new_keywords)
         
         # Merge dynamic keywords with static ones periodically
         if len(self.dynamic_keywords[subject]) > 5:
             # Add most frequent dynamic keywords to permanent keywords
             frequent_keywords = []
             for keyword in self.dynamic_keywords[subject]:
-                if self.word_frequencies[keyword] > 3:
+                if self.word_frequencies.get(keyword, 0) > 3:
                     frequent_keywords.append(keyword)
             
             if frequent_keywords:
-                self.subject_keywords[subject].update(frequent_keywords[:3])
-                # Remove learned keywords from dynamic set
-                for kw in frequent_keywords:
-                    self.dynamic_keywords[subject].discard(kw)
+                self.record_change('keyword_promoted', subject=subject,
+                                   keywords=self._promotable(subject, frequent_keywords[:3]),
+                                   discarded=frequent_keywords)
+                demoted = self._demoted_keywords(subject)
+                if demoted:
+                    self.record_change('keywords_demoted', subject=subject, keywords=demoted)
     
-    def classify_subject(self, question):
-        """Enhanced subject classification with learning"""
-        words = self.tokenize(question)
-        subject_scores = {}
+    def _promoted(self, subject: str) -> Set[str]:
+        """Keywords a subject has learned, as opposed to its built-in ones"""
+        return self.subject_keywords.get(subject, set()) - self.seed_keywords.get(subject, frozenset())
+    
+    def _promotable(self, subject: str, keywords: List[str]) -> List[str]:
+        """keywords, or near the cap only those more frequent than every promoted one, so promotions do not churn"""
+        limit = self.limits.promoted_keywords
+        promoted = self._promoted(subject)
+        if not limit or len(promoted) < slack(limit):
+            return keywords
+        floor = min((self.word_frequencies.get(k, 0) for k in promoted), default=0)
+        return [keyword for keyword in keywords if self.word_frequencies.get(keyword, 0) > floor]
+    
+    def _demoted_keywords(self, subject: str) -> List[str]:
+        """A subject's least frequent promoted keywords beyond the cap; built-in ones are never demoted"""
+        promoted = self._promoted(subject)
+        return lowest(promoted, lambda k: self.word_frequencies.get(k, 0), self.limits.promoted_keywords, len(promoted))
+    
+    @read_locked
+    def analyze(self, question: str, session: Optional[SessionState] = None,
+                subject: Optional[str] = None) -> RequestAnalysis:
+        """Tokenize, classify and pick keywords for a question once, for every stage to share.
+        
+        A subject already known (from a batch classification) is used as is.
+        """
+        tokens = tokenize_text(question)
+        subject_scores = None
+        if subject is None:
+            subject_scores = self.score_subjects(tokens, session)
+            subject = self.best_subject(subject_scores)
+        return RequestAnalysis(question, tokens, subject, subject_scores)
+    
+    def classify_subject_scores(self, question, session: Optional[SessionState] = None) -> Dict[str, float]:
+        """Score every subject for a question"""
+        return self.score_subjects(tokenize_text(question), session)
+    
+    @read_locked
+    def score_subjects(self, words, session: Optional[SessionState] = None) -> Dict[str, float]:
+        """Score every subject for a tokenized question"""
+        subject_scores = self.subject_matcher.score(words, self.subject_keywords)
         
-        for subject, keywords in self.subject_keywords.items():
-            score = 0
-            
-            # Static keywords
-            for word in words:
-                if word in keywords:
-                    score += 3
-                # Partial matching
-                for keyword in keywords:
-                    if word in keyword or keyword in word:
-                        score += 1
-            
-            # Dynamic keywords
-            for word in words:
-                if word in self.dynamic_keywords[subject]:
-                    score += 2
-            
+        # Context boost - if the session's recent questions were about this subject
+        recent_subjects = self.session(session).recent_subjects(3)
+        
+        for subject in subject_scores:
             # Historical success boost
             if subject in self.subject_expertise:
-                score += self.subject_expertise[subject] * 0.1
+                subject_scores[subject] += self.subject_expertise[subject] * 0.1
             
-            # Context boost - if recent questions were about this subject
-            recent_subjects = [ctx.get('subject', 'general') for ctx in self.context_memory[-3:]]
             if subject in recent_subjects:
-                score += 1
-            
-            subject_scores[subject] = score
+                subject_scores[subject] += 1
         
+        return subject_scores
+    
+    @read_locked
+    def classify_subject(self, question, session: Optional[SessionState] = None):
+        """Enhanced subject classification with learning"""
+        return self.best_subject(self.classify_subject_scores(question, session))
+    
+    @staticmethod
+    def best_subject(subject_scores: Dict[str, float]) -> str:
+        """The highest scoring subject, or 'general' if none scored"""
         # Return subject with highest score
         if subject_scores:
             best_subject = max(subject_scores.items(), key=lambda x: x[1])[0]
@@ -361,70 +830,86 @@ class EnhancedLearningQABot:
         
         return 'general'
     
-    def extract_question_keywords(self, question):
+    @read_locked
+    def classify_subjects(self, questions: List[str], session: Optional[SessionState] = None) -> List[Tuple[str, float]]:
+        """Classify a batch of questions at once without touching learning state.
+        
+        Returns (subject, score) for each question, in order.
+        """
+        subjects = list(self.subject_keywords)
+        if not questions:
+            return []
+        if not subjects:
+            return [('general', 0.0) for _ in questions]
+        
+        documents = [tokenize_text(question) for question in questions]
+        scores = self.subject_matcher.score_batch(documents, subjects)
+        
+        # Same boosts as classify_subject_scores, applied to every row
+        recent_subjects = self.session(session).recent_subjects(3)
+        expertise_boost = np.array([self.subject_expertise[subject] * 0.1 if subject in self.subject_expertise else 0.0
+                                    for subject in subjects])
+        context_boost = np.array([1.0 if subject in recent_subjects else 0.0 for subject in subjects])
+        scores += expertise_boost
+        scores += context_boost
+        
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(questions)), best]
+        return [(subjects[column], float(score)) if score > 0 else ('general', float(score))
+                for column, score in zip(best, best_scores)]
+    
+    def extract_question_keywords(self, question, analysis: Optional[RequestAnalysis] = None):
         """Extract key terms from question for knowledge retrieval and store them in all_keywords"""
-        words = self.tokenize(question)
-        question_words = {'what', 'how', 'why', 'when', 'where', 'who', 'which', 'does', 'can', 'will', 'would', 'should', 'could', 'tell', 'explain', 'describe'}
-        keywords = [word for word in words if word not in question_words and len(word) > 2]
+        keywords = analysis.keywords if analysis else question_keywords(tokenize_text(question))
         # Store keywords in all_keywords
-        self.all_keywords.update(keywords)
+        new_keywords = [kw for kw in dict.fromkeys(keywords) if kw not in self.all_keywords]
+        if new_keywords:
+            self.record_change('keywords', keywords=new_keywords)
         return keywords
     
+    @read_locked
     def search_knowledge_base(self, subject, keywords) -> Optional[Tuple[str, str, str]]:
         """Enhanced knowledge base search with learning"""
         if subject not in self.knowledge_base:
             return None
         
-        subject_kb = self.knowledge_base[subject]
-        best_match = None
-        best_score = 0
-        
-        def search_recursive(data, path=""):
-            nonlocal best_match, best_score
-            
-            if isinstance(data, dict):
-                for key, value in data.items():
-                    key_score = sum(1 for keyword in keywords if keyword in key.lower() or key.lower() in keyword)
-                    
-                    if isinstance(value, str):
-                        content_score = sum(1 for keyword in keywords if keyword in value.lower())
-                        
-                        # Boost score for learned successful patterns
-                        pattern_key = f"{subject}_{key}"
-                        if pattern_key in self.success_patterns:
-                            content_score += len(self.success_patterns[pattern_key]) * 0.5
-                        
-                        total_score = key_score * 2 + content_score
-                        
-                        if total_score > best_score:
-                            best_score = total_score
-                            best_match = (key, value, path)
-                    else:
-                        search_recursive(value, f"{path}/{key}" if path else key)
-        
-        search_recursive(subject_kb)
-        return best_match
+        # Only leaves sharing text with a keyword (or boosted by success) are scored
+        return self.knowledge_index.search(subject, keywords)
     
-    def search_learned_responses(self, question: str, subject: str) -> Optional[str]:
+    def search_learned_responses(self, question: str, subject: str, min_similarity: float = 0.4) -> Optional[str]:
         """Search through learned responses for similar questions"""
-        if subject not in self.learned_responses:
-            return None
-        
+        return self.best_learned_response(question, subject, min_similarity)[0]
+    
+    @read_locked
+    def best_learned_response(self, question: str, subject: str,
+                              min_similarity: float = 0.4) -> Tuple[Optional[str], float]:
+        """Return the best learned response and its feedback-weighted similarity.
+        
+        Word overlap within the subject is tried first. A paraphrase it misses
+        can still match on hashed TF-IDF cosine, in any subject, since a
+        reworded question is not always classified the same way. Matches
+        must be more similar than min_similarity either way.
+        """
         best_response = None
         best_score = 0
         
-        for learned_item in self.learned_responses[subject]:
-            similarity = self.calculate_text_similarity(question, learned_item['question'])
-            
-            # Weight by feedback score
-            feedback_weight = learned_item.get('avg_feedback', 3) / 5.0
-            weighted_score = similarity * feedback_weight
-            
-            if weighted_score > best_score and similarity > 0.4:
-                best_score = weighted_score
+        if subject in self.learned_responses:
+            for learned_item, similarity in self.learned_index[subject].similar(question):
+                # Weight by feedback score
+                feedback_weight = learned_item.get('avg_feedback', 3) / 5.0
+                weighted_score = similarity * feedback_weight
+                
+                if weighted_score > best_score and similarity > min_similarity:
+                    best_score = weighted_score
+                    best_response = learned_item['response']
+        
+        if best_response is None:
+            threshold = max(self.semantic_threshold, min_similarity)
+            for learned_item, similarity in self.semantic_index.search(question, 1, threshold):
+                best_score = similarity * learned_item.get('avg_feedback', 3) / 5.0
                 best_response = learned_item['response']
         
-        return best_response
+        return best_response, best_score
     
     def calculate_math_expression(self, expression):
         """Safely evaluate mathematical expressions"""
@@ -440,12 +925,13 @@ class EnhancedLearningQABot:
         except:
             return None
     
-    def generate_math_response(self, question):
-        """Generate response for math questions with learning"""
+    def generate_math_response(self, question, learned_similarity: Optional[float] = 0.4):
+        """Generate response for math questions with learning; learned_similarity=None skips learned patterns"""
         # Check for learned math patterns first
-        learned_response = self.search_learned_responses(question, 'mathematics')
-        if learned_response:
-            return learned_response
+        if learned_similarity is not None:
+            learned_response = self.search_learned_responses(question, 'mathematics', learned_similarity)
+            if learned_response:
+                return learned_response
         
         # Extract mathematical expressions
         math_patterns = [
@@ -491,27 +977,44 @@ class EnhancedLearningQABot:
         
         return None
     
-    def generate_response(self, question):
-        """Generate comprehensive response with enhanced learning. Returns (response, is_fallback)"""
-        # Learn from context
-        self.learn_from_context(question)
-        subject = self.classify_subject(question)
-        self.learn_dynamic_keywords(question, subject)
-        self.subject_expertise[subject] += 1
-        keywords = self.extract_question_keywords(question)
-        similar_questions = self.find_similar_questions(question)
+    @write_locked
+    def generate_response(self, question, session: Optional[SessionState] = None,
+                          analysis: Optional[RequestAnalysis] = None, learned_similarity: Optional[float] = 0.4):
+        """Generate comprehensive response with enhanced learning. Returns (response, is_fallback).
+
+        learned_similarity=None skips the learned responses, for callers that already tried them.
+        """
+        session = self.session(session)
+        # Classify before the question joins the session's context, then learn from it
+        analysis = analysis or self.analyze(question, session)
+        subject = analysis.subject
+        self.observe_question(question, analysis)
+        self.learn_from_context(question, subject, session, analysis)
+        self.learn_dynamic_keywords(question, subject, analysis)
+        keywords = self.extract_question_keywords(question, analysis)
+        self.record_change('asked', subject=subject, keywords=keywords)
+        # Nothing below changes the factors, so the history entry and the reply share them
+        analysis.confidence_factors = self.calculate_confidence_factors(subject, keywords, session)
+        similar_questions = self.find_similar_questions(question, analysis=analysis)
         if similar_questions:
             best_similar = similar_questions[0]
             if best_similar['similarity'] > 0.7 and (best_similar.get('feedback', 0) or 0) >= 4:
                 response = f"Based on a similar question I answered before: {best_similar['response']}"
-                return self.format_response(response, subject, keywords, is_learned=True), False
-        learned_response = self.search_learned_responses(question, subject)
+                session.last_interaction = self.interaction(question, response, subject, keywords)
+                return self.format_response(response, subject, keywords, is_learned=True, session=session,
+                                            analysis=analysis), False
+        learned_response = None
+        if learned_similarity is not None:
+            learned_response = self.search_learned_responses(question, subject, learned_similarity)
         if learned_response:
-            return self.format_response(learned_response, subject, keywords, is_learned=True), False
+            session.last_interaction = self.interaction(question, learned_response, subject, keywords)
+            return self.format_response(learned_response, subject, keywords, is_learned=True, session=session,
+                                        analysis=analysis), False
         if subject == 'mathematics':
-            math_response = self.generate_math_response(question)
+            math_response = self.generate_math_response(question, learned_similarity)
             if math_response:
-                return self.format_response(math_response, subject, keywords), False
+                session.last_interaction = self.interaction(question, math_response, subject, keywords)
+                return self.format_response(math_response, subject, keywords, session=session, analysis=analysis), False
         knowledge_result = self.search_knowledge_base(subject, keywords)
         if isinstance(knowledge_result, tuple) and len(knowledge_result) == 3:
             key, content, path = knowledge_result
@@ -520,9 +1023,7 @@ class EnhancedLearningQABot:
             if related_info:
                 response += f"\n\nRelated information: {related_info}"
             pattern_key = f"{subject}_{key}"
-            if pattern_key not in self.success_patterns:
-                self.success_patterns[pattern_key] = []
-            self.success_patterns[pattern_key].append({
+            self.record_change('success', key=pattern_key, keep=self.limits.success_records, record={
                 'question': question,
                 'keywords': keywords,
                 'timestamp': datetime.now().isoformat()
@@ -539,22 +1040,29 @@ class EnhancedLearningQABot:
             'response': response,
             'feedback': None,
             'similar_questions': len(similar_questions),
-            'confidence_factors': self.calculate_confidence_factors(subject, keywords)
+            'confidence_factors': analysis.confidence_factors
         }
-        self.conversation_history.append(conversation_entry)
-        if len(self.conversation_history) % 3 == 0:
-            self.save_ml_data()
-        return self.format_response(response, subject, keywords), is_fallback
+        self.record_change('history', entry=conversation_entry)
+        session.last_interaction = conversation_entry
+        return self.format_response(response, subject, keywords, session=session, analysis=analysis), is_fallback
+    
+    @staticmethod
+    def interaction(question, response, subject, keywords) -> Dict:
+        """What get_feedback needs to know about an answer"""
+        return {'question': question, 'response': response, 'subject': subject, 'keywords': keywords}
     
-    def calculate_confidence_factors(self, subject: str, keywords: List[str]) -> Dict:
+    @read_locked
+    def calculate_confidence_factors(self, subject: str, keywords: List[str],
+                                     session: Optional[SessionState] = None) -> Dict:
         """Calculate various confidence factors"""
         return {
             'subject_expertise': self.subject_expertise.get(subject, 0),
             'keyword_familiarity': sum(self.word_frequencies.get(kw, 0) for kw in keywords),
-            'recent_subject_focus': len([ctx for ctx in self.context_memory[-5:] if ctx.get('subject') == subject]),
-            'average_feedback': np.mean(self.response_feedback.get(subject, [3])) if self.response_feedback.get(subject) else 3
+            'recent_subject_focus': self.session(session).recent_subjects(5).count(subject),
+            'average_feedback': self.aggregates.average_feedback(subject, default=3)
         }
     
+    @read_locked
     def get_related_info(self, subject, key):
         """Get related information from knowledge base"""
         if subject in self.knowledge_base:
@@ -570,12 +1078,17 @@ class EnhancedLearningQABot:
             return " | ".join(related) if related else None
         return None
     
+    @read_locked
     def generate_contextual_response(self, subject, keywords, question):
         """Generate contextual response with learning"""
         # Check for learned response templates
         if subject in self.response_templates and self.response_templates[subject]:
             template = random.choice(self.response_templates[subject])
-            return template.format(keywords=', '.join(keywords[:3]) if keywords else 'various topics')
+            try:
+                return template.format(keywords=', '.join(keywords[:3]) if keywords else 'various topics')
+            except (KeyError, IndexError, ValueError):
+                # Learned templates may hold {number}/{proper_noun} slots or literal braces
+                pass
         
         # Default responses with context awareness
         responses = {
@@ -607,9 +1120,11 @@ class EnhancedLearningQABot:
         
         return base_response
     
-    def format_response(self, response, subject, keywords, is_learned=False):
-        """Format response with enhanced context and confidence"""
-        confidence_factors = self.calculate_confidence_factors(subject, keywords)
+    @read_locked
+    def overall_confidence(self, subject, keywords, session: Optional[SessionState] = None,
+                           confidence_factors: Optional[Dict] = None) -> float:
+        """Combine the confidence factors (computed if not given) into a 20-100 percentage"""
+        confidence_factors = confidence_factors or self.calculate_confidence_factors(subject, keywords, session)
         
         # Calculate overall confidence
         base_confidence = min(100, max(20, confidence_factors['subject_expertise'] * 5 + 50))
@@ -617,7 +1132,13 @@ class EnhancedLearningQABot:
         context_boost = confidence_factors['recent_subject_focus'] * 5
         feedback_boost = (confidence_factors['average_feedback'] - 3) * 10
         
-        overall_confidence = min(100, max(20, base_confidence + keyword_boost + context_boost + feedback_boost))
+        return min(100, max(20, base_confidence + keyword_boost + context_boost + feedback_boost))
+    
+    def format_response(self, response, subject, keywords, is_learned=False, session: Optional[SessionState] = None,
+                        analysis: Optional[RequestAnalysis] = None):
+        """Format response with enhanced context and confidence"""
+        overall_confidence = self.overall_confidence(subject, keywords, session,
+                                                     analysis.confidence_factors if analysis else None)
         
         # Format response with learning indicators
         learning_indicator = "🧠 Learned" if is_learned else "📚 Knowledge"
@@ -639,44 +1160,44 @@ class EnhancedLearningQABot:
         
         return formatted
     
-    def get_feedback(self, rating):
-        """Enhanced feedback processing with learning"""
-        if not self.conversation_history:
+    @write_locked
+    def get_feedback(self, rating, session: Optional[SessionState] = None):
+        """Enhanced feedback processing with learning; rates the session's last answer"""
+        last_interaction = self.session(session).last_interaction
+        if last_interaction is None and session is None and self.conversation_history:
+            # chat() picks up where the last run left off
+            last_interaction = self.conversation_history[-1]
+        if last_interaction is None:
             return "No recent response to rate."
         
-        last_interaction = self.conversation_history[-1]
         subject = last_interaction['subject']
         question = last_interaction['question']
         response = last_interaction['response']
         
         # Store feedback
-        self.response_feedback[subject].append(rating)
-        self.conversation_history[-1]['feedback'] = rating
+        self.record_change('feedback', subject=subject, rating=rating)
+        self.record_change('history_feedback', rating=rating, question=question)
         
         # Learn from feedback
         if rating >= 4:
             # Positive feedback - reinforce this response
-            self.subject_expertise[subject] += 2
-            
-            # Store as learned response
-            if subject not in self.learned_responses:
-                self.learned_responses[subject] = []
+            self.record_change('expertise', subject=subject, delta=2)
             
             # Check if similar response already exists
             existing_response = None
-            for learned_item in self.learned_responses[subject]:
-                if self.calculate_text_similarity(question, learned_item['question']) > 0.6:
+            for learned_item, similarity in self.learned_index[subject].similar(question):
+                if similarity > 0.6:
                     existing_response = learned_item
                     break
             
             if existing_response:
                 # Update existing response
-                existing_response['feedback_scores'].append(rating)
-                existing_response['avg_feedback'] = np.mean(existing_response['feedback_scores'])
-                existing_response['usage_count'] += 1
+                position = next(i for i, item in enumerate(self.learned_responses[subject]) if item is existing_response)
+                self.record_change('learned_rated', subject=subject, index=position, rating=rating,
+                                   question=existing_response['question'], keep=self.limits.ratings)
             else:
                 # Add new learned response
-                self.learned_responses[subject].append({
+                self.add_learned_response(subject, {
                     'question': question,
                     'response': response,
                     'feedback_scores': [rating],
@@ -687,24 +1208,18 @@ class EnhancedLearningQABot:
                 })
             
             # Store successful response template
-            if subject not in self.response_templates:
-                self.response_templates[subject] = []
-            
             # Extract template pattern
             template = re.sub(r'\b\d+\b', '{number}', response)
             template = re.sub(r'\b[A-Z][a-z]+\b', '{proper_noun}', template)
-            if template not in self.response_templates[subject]:
-                self.response_templates[subject].append(template)
+            if template not in self.response_templates.get(subject, []):
+                self.record_change('template', subject=subject, template=template, keep=self.limits.templates)
         
         elif rating <= 2:
             # Negative feedback - learn what to avoid
-            self.subject_expertise[subject] = max(0, self.subject_expertise[subject] - 1)
+            self.record_change('expertise', subject=subject, delta=-1)
             
             # Store correction opportunity
-            if subject not in self.correction_memory:
-                self.correction_memory[subject] = []
-            
-            self.correction_memory[subject].append({
+            self.record_change('correction', subject=subject, keep=self.limits.corrections, record={
                 'question': question,
                 'poor_response': response,
                 'rating': rating,
@@ -713,10 +1228,7 @@ class EnhancedLearningQABot:
             })
         
         # Learn user preferences
-        self.learn_user_preferences(last_interaction, rating)
-        
-        # Save learning data
-        self.save_ml_data()
+        self.learn_user_preferences(last_interaction, rating, session)
         
         feedback_messages = {
             5: "Excellent! I'm learning that this type of response works really well.",
@@ -728,43 +1240,46 @@ class EnhancedLearningQABot:
         
         return f"Thank you for rating my {subject} response! {feedback_messages.get(rating, 'Thanks for the feedback!')}"
     
-    def learn_user_preferences(self, interaction, rating):
-        """Learn user preferences from interactions"""
+    def learn_user_preferences(self, interaction, rating, session: Optional[SessionState] = None):
+        """Learn user preferences from interactions, for the session and across all users"""
         subject = interaction['subject']
         keywords = interaction.get('keywords', [])
         
         # Track preference patterns
         pref_key = f"{subject}_style"
-        if pref_key not in self.user_preferences:
-            self.user_preferences[pref_key] = {'detailed': 0, 'concise': 0, 'examples': 0}
         
         # Analyze response characteristics
         response_length = len(interaction['response'].split())
         has_examples = 'example' in interaction['response'].lower() or ':' in interaction['response']
         
+        style_fields = []
         if rating >= 4:
             if response_length > 50:
-                self.user_preferences[pref_key]['detailed'] += 1
+                style_fields.append('detailed')
             elif response_length < 30:
-                self.user_preferences[pref_key]['concise'] += 1
+                style_fields.append('concise')
             
             if has_examples:
-                self.user_preferences[pref_key]['examples'] += 1
+                style_fields.append('examples')
+        self.record_change('preference', key=pref_key, fields=style_fields)
+        self.session(session).prefer(pref_key, style_fields)
         
         # Learn keyword preferences
         if rating >= 4:
             for keyword in keywords:
-                pref_key = f"keyword_{keyword}"
-                self.user_preferences[pref_key] = self.user_preferences.get(pref_key, 0) + 1
+                self.record_change('preference', key=f"keyword_{keyword}", delta=1)
     
+    @write_locked
     def teach_me(self, topic, information):
         """Allow user to teach the bot new information"""
         if not topic or not information:
             return "Please provide both a topic and the information you'd like to teach me!"
         
         # Classify the topic
-        subject = self.classify_subject(topic)
-        keywords = self.extract_question_keywords(topic)
+        analysis = self.analyze(topic)
+        self.observe_question(topic, analysis)
+        subject = analysis.subject
+        keywords = self.extract_question_keywords(topic, analysis)
         
         # Store the new information
         teaching_entry = {
@@ -777,10 +1292,7 @@ class EnhancedLearningQABot:
         }
         
         # Add to learned responses
-        if subject not in self.learned_responses:
-            self.learned_responses[subject] = []
-        
-        self.learned_responses[subject].append({
+        self.add_learned_response(subject, {
             'question': topic,
             'response': information,
             'feedback_scores': [5],  # Assume user-taught info is high quality
@@ -792,43 +1304,46 @@ class EnhancedLearningQABot:
         })
         
         # Update expertise
-        self.subject_expertise[subject] += 3
+        self.record_change('expertise', subject=subject, delta=3)
         
         # Learn new keywords
         self.learn_dynamic_keywords(topic, subject)
         
-        # Save the learning
-        self.save_ml_data()
-        
         return f"Thank you for teaching me about {topic}! I've learned: {information}\nI've categorized this under {subject} and will remember it for future questions."
     
+    @write_locked
     def forget_topic(self, topic):
         """Allow user to remove incorrect information"""
         removed_count = 0
+        forgotten_questions = [topic]
         
-        for subject in self.learned_responses:
-            self.learned_responses[subject] = [
-                item for item in self.learned_responses[subject]
-                if self.calculate_text_similarity(topic, item['question']) < 0.5
-            ]
-            removed_count += len(self.learned_responses[subject])
+        for subject in list(self.learned_responses):
+            forgotten = {id(item) for item, similarity in self.learned_index[subject].similar(topic) if similarity >= 0.5}
+            if forgotten:
+                items = [(i, item) for i, item in enumerate(self.learned_responses[subject]) if id(item) in forgotten]
+                self.record_learned_removed(subject, [i for i, _ in items])
+                forgotten_questions.extend(item['question'] for _, item in items)
+                removed_count += len(items)
         
-        # Also remove from correction memory
-        for subject in self.correction_memory:
-            original_length = len(self.correction_memory[subject])
-            self.correction_memory[subject] = [
-                item for item in self.correction_memory[subject]
-                if self.calculate_text_similarity(topic, item['question']) < 0.5
-            ]
-            removed_count += original_length - len(self.correction_memory[subject])
+        # Cached Gemini answers would otherwise bring the forgotten answers straight back
+        self.answer_cache.forget(forgotten_questions)
         
-        self.save_ml_data()
+        # Also remove from correction memory
+        for subject in list(self.correction_memory):
+            items = [(i, item) for i, item in enumerate(self.correction_memory[subject])
+                     if self.calculate_text_similarity(topic, item['question']) >= 0.5]
+            indices = [i for i, _ in items]
+            if indices:
+                self.record_change('corrections_removed', subject=subject, indices=indices,
+                                   questions=[item['question'] for _, item in items])
+            removed_count += len(indices)
         
         if removed_count > 0:
             return f"I've removed {removed_count} learned responses related to '{topic}'."
         else:
             return f"I couldn't find any learned responses related to '{topic}' to remove."
     
+    @read_locked
     def show_expertise(self):
         """Show current subject expertise levels with learning details"""
         if not self.subject_expertise:
@@ -840,7 +1355,7 @@ class EnhancedLearningQABot:
         for subject, level in sorted_subjects:
             bars = "█" * min(level, 20)
             learned_count = len(self.learned_responses.get(subject, []))
-            avg_feedback = np.mean(self.response_feedback.get(subject, [3])) if self.response_feedback.get(subject) else 3
+            avg_feedback = self.aggregates.average_feedback(subject, default=3)
             
             expertise_str += f"{subject.title()}: {bars} ({level})\n"
             expertise_str += f"  📚 Learned responses: {learned_count}\n"
@@ -849,6 +1364,7 @@ class EnhancedLearningQABot:
         
         return expertise_str
     
+    @read_locked
     def show_learned_responses(self):
         """Show learned responses summary"""
         if not self.learned_responses:
@@ -871,9 +1387,11 @@ class EnhancedLearningQABot:
         
         return summary
     
+    @read_locked
     def show_stats(self):
         """Show comprehensive statistics with learning metrics"""
-        total_questions = len(self.conversation_history)
+        aggregates = self.aggregates
+        total_questions = aggregates.questions
         if total_questions == 0:
             return "No questions answered yet!"
         
@@ -881,35 +1399,21 @@ class EnhancedLearningQABot:
         total_learned = sum(len(responses) for responses in self.learned_responses.values())
         total_corrections = sum(len(corrections) for corrections in self.correction_memory.values())
         
-        # Subject distribution
-        subjects = [conv['subject'] for conv in self.conversation_history]
-        subject_counts = Counter(subjects)
-        
-        # Average feedback
-        feedbacks = [conv['feedback'] for conv in self.conversation_history if conv.get('feedback')]
-        avg_feedback = sum(feedbacks) / len(feedbacks) if feedbacks else 0
-        
         # Learning rate (how many responses become learned)
-        learning_rate = (total_learned / total_questions * 100) if total_questions > 0 else 0
-        
-        # Most common keywords
-        all_keywords = []
-        for conv in self.conversation_history:
-            all_keywords.extend(conv.get('keywords', []))
-        common_keywords = Counter(all_keywords).most_common(5)
+        learning_rate = total_learned / total_questions * 100
         
-        # Recent learning trend
-        recent_feedback = [conv['feedback'] for conv in self.conversation_history[-10:] if conv.get('feedback')]
-        recent_avg = sum(recent_feedback) / len(recent_feedback) if recent_feedback else 0
+        training = self.training.stats()
+        training_dropped = training['dropped_duplicate'] + training['dropped_full'] + training['dropped_closed']
+        flight = self.gemini_flight.stats()
         
         stats = f"""
 🧠 Enhanced Learning Bot Statistics:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 📊 BASIC METRICS:
   📝 Total Questions Answered: {total_questions}
-  ⭐ Average Rating: {avg_feedback:.1f}/5.0
-  📈 Recent Performance: {recent_avg:.1f}/5.0 (last 10 responses)
-  🧠 Knowledge Areas: {len(subject_counts)}
+  ⭐ Average Rating: {aggregates.average_feedback():.1f}/5.0
+  📈 Recent Performance: {aggregates.recent_average():.1f}/5.0 (last {aggregates.recent_feedback.maxlen} responses)
+  🧠 Knowledge Areas: {len(aggregates.subject_counts)}
   📚 Vocabulary Size: {len(self.word_frequencies)}
 
 🎓 LEARNING METRICS:
@@ -917,31 +1421,36 @@ class EnhancedLearningQABot:
   📈 Learning Rate: {learning_rate:.1f}% (responses that became learned)
   🔄 Corrections Stored: {total_corrections}
   🎯 Dynamic Keywords: {sum(len(kw) for kw in self.dynamic_keywords.values())}
-  💭 Context Memory: {len(self.context_memory)} recent interactions
+  💭 Active Sessions: {len(self.sessions)} (each remembering up to {self.sessions.context_size} interactions)
+  🏋️ Background Training: {training['queue_depth']} queued, {training['completed']} done, {training['failed']} failed, {training_dropped} dropped
+  🔗 Gemini Requests: {flight['upstream_calls']} made, {flight['coalesced']} shared with an identical request
 
 📈 Subject Distribution:
-{chr(10).join([f"  {subject.title()}: {count} questions" for subject, count in subject_counts.most_common()])}
+{chr(10).join([f"  {subject.title()}: {count} questions" for subject, count in aggregates.subject_counts.most_common()])}
 
 🔤 Most Common Keywords:
-{chr(10).join([f"  {keyword}: {count} times" for keyword, count in common_keywords])}
+{chr(10).join([f"  {keyword}: {count} times" for keyword, count in aggregates.keywords.top(5)])}
+
+🔁 Frequent Topic Transitions:
+{chr(10).join([f"  {transition['pattern']}: {transition['count']} times" for transition in self.top_transitions()])}
 
 🎯 Expertise Levels:
 {chr(10).join([f"  {subject.title()}: Level {level}" for subject, level in sorted(self.subject_expertise.items(), key=lambda x: x[1], reverse=True)])}
 
 📊 Learning Quality:
-{chr(10).join([f"  {subject.title()}: {np.mean(feedback):.1f}/5.0 avg rating" for subject, feedback in self.response_feedback.items() if feedback])}
+{chr(10).join([f"  {subject.title()}: {aggregates.average_feedback(subject):.1f}/5.0 avg rating" for subject in aggregates.subject_feedback])}
 """
         return stats
     
+    @write_locked
     def remember_fact(self, fact):
         """Allow user to store a free-form fact in memory."""
         if not fact:
             return "Please provide something for me to remember!"
         subject = 'general'
+        self.observe_question(fact)
         keywords = self.extract_question_keywords(fact)
-        if subject not in self.learned_responses:
-            self.learned_responses[subject] = []
-        self.learned_responses[subject].append({
+        self.add_learned_response(subject, {
             'question': fact,
             'response': fact,
             'feedback_scores': [5],
@@ -951,20 +1460,19 @@ class EnhancedLearningQABot:
             'keywords': keywords,
             'user_taught': True
         })
-        self.save_ml_data()
         return f"I've remembered: '{fact}'!"
 
+    @write_locked
     def store_learned_qa(self, question, answer):
         """Store a Q&A pair in learned_responses for future recall."""
-        subject = self.classify_subject(question)
-        keywords = self.extract_question_keywords(question)
-        if subject not in self.learned_responses:
-            self.learned_responses[subject] = []
+        analysis = self.analyze(question)
+        subject = analysis.subject
+        keywords = self.extract_question_keywords(question, analysis)
         # Avoid duplicates
-        for item in self.learned_responses[subject]:
-            if self.calculate_text_similarity(question, item['question']) > 0.7:
+        for item, similarity in self.learned_index[subject].similar(question):
+            if similarity > 0.7:
                 return  # Already learned
-        self.learned_responses[subject].append({
+        self.add_learned_response(subject, {
             'question': question,
             'response': answer,
             'feedback_scores': [5],
@@ -974,28 +1482,214 @@ class EnhancedLearningQABot:
             'keywords': keywords,
             'user_taught': False
         })
-        self.save_ml_data()
+
+    def train_from_gemini(self, question):
+        """Learn Gemini's answer to question; failures are not learned"""
+        answer, ok = self.query_gemini(question, learn=True)
+        if not ok:
+            raise LLMError(answer)
 
     def ask_gemini(self, prompt):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            return "Gemini API key not found. Please set GEMINI_API_KEY environment variable."
-        import google.generativeai as genai
-        genai.configure(api_key=api_key)
+        return self.query_gemini(prompt)[0]
+
+    def gemini_prompt(self, prompt) -> str:
         system_prompt = (
             "You are Liam, a chat bot designed to assist users with a wide range of topics. "
             
         )
-        full_prompt = f"{system_prompt}\n\nUser question: {prompt}"
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(full_prompt)
-        # The latest google-generativeai returns response.text or response.candidates[0].text
-        if hasattr(response, 'text'):
-            return response.text.strip()
-        elif hasattr(response, 'candidates') and response.candidates:
-            return response.candidates[0].text.strip()
+        return f"{system_prompt}\n\nUser question: {prompt}"
+
+    def query_gemini(self, prompt, learn=False) -> Tuple[str, bool]:
+        """Return (answer, True), or (error message, False) if Gemini failed.
+        
+        Concurrent calls for the same normalized prompt share one Gemini
+        request. With learn, a fetched answer is also stored as a learned
+        response, once, by the caller that made the request.
+        """
+        cached = self.answer_cache.get(prompt)
+        if cached is not None:
+            return cached, True
+        try:
+            answer, learned = self.gemini_flight.do(fold_prompt(prompt), lambda: self._fetch_gemini(prompt, learn))
+        except LLMError as e:
+            return str(e), False
+        if learn and not learned:
+            # The shared request came from a caller that does not learn
+            self.store_learned_qa(prompt, answer)
+        return answer, True
+    
+    def _fetch_gemini(self, prompt, learn) -> Tuple[str, bool]:
+        answer = self.llm.generate(self.gemini_prompt(prompt))
+        self.answer_cache.put(prompt, answer)
+        if learn:
+            self.store_learned_qa(prompt, answer)
+        return answer, learn
+
+    def answer_local(self, question, min_confidence, timings, subject=None,
+                     session: Optional[SessionState] = None) -> Optional[Dict]:
+        """Try the learned and local tiers; None if neither is confident enough"""
+        session = self.session(session)
+        started = time.perf_counter()
+        analysis = self.analyze(question, session, subject)
+        subject = analysis.subject
+        learned_answer, score = self.best_learned_response(question, subject, self.learned_similarity)
+        timings['learned'] = (time.perf_counter() - started) * 1000
+        if learned_answer and score * 100 >= min_confidence:
+            self.remember_learned_answer(question, learned_answer, analysis, session)
+            return {'message': learned_answer, 'tier': 'learned', 'confidence': score * 100, 'timings_ms': timings}
+
+        started = time.perf_counter()
+        # The learned tier above already accepted or rejected the best learned answer
+        response, is_fallback = self.generate_response(question, session, analysis, learned_similarity=None)
+        # The confidence the reply itself reports
+        confidence = self.overall_confidence(subject, analysis.keywords, session, analysis.confidence_factors)
+        timings['local'] = (time.perf_counter() - started) * 1000
+        if not is_fallback and confidence >= min_confidence:
+            return {'message': response, 'tier': 'local', 'confidence': confidence, 'timings_ms': timings}
+        return None
+
+    def answer_tiered(self, question, min_confidence=None, session: Optional[SessionState] = None) -> Dict:
+        """Answer from the cheapest tier that is confident enough.
+
+        Tiers run in the same order as chat(): learned responses, then the
+        knowledge base / math engine via generate_response, then Gemini.
+        Confidence is a 0-100 percentage: the feedback-weighted similarity
+        for learned responses and the response confidence for local answers.
+        """
+        timings = {}
+        result = self.answer_local(question, self.min_confidence if min_confidence is None else min_confidence, timings,
+                                   session=session)
+        if result:
+            return result
+
+        started = time.perf_counter()
+        answer, ok = self.query_gemini(question, learn=True)
+        if ok:
+            self.remember_gemini_answer(question, answer, session)
+        timings['gemini'] = (time.perf_counter() - started) * 1000
+        return {'message': answer, 'tier': 'gemini', 'confidence': None, 'timings_ms': timings}
+
+    def remember_learned_answer(self, question, answer, analysis: RequestAnalysis,
+                                session: Optional[SessionState] = None):
+        """Record a question answered from learned responses as generate_response records the others"""
+        session = self.session(session)
+        self.observe_question(question, analysis)
+        self.learn_from_context(question, analysis.subject, session, analysis)
+        keywords = self.extract_question_keywords(question, analysis)
+        self.record_change('asked', subject=analysis.subject, keywords=keywords)
+        session.last_interaction = self.interaction(question, answer, analysis.subject, keywords)
+
+    def remember_gemini_answer(self, question, answer, session: Optional[SessionState] = None):
+        """Make a Gemini answer the one the session's next rating applies to"""
+        analysis = self.analyze(question, session)
+        self.session(session).last_interaction = self.interaction(
+            question, answer, analysis.subject, self.extract_question_keywords(question, analysis))
+
+    def answer_local_batch(self, questions: List[str], min_confidence=None,
+                           session: Optional[SessionState] = None) -> Tuple[List[Optional[Dict]], List[Tuple[int, Dict]]]:
+        """Run the local tiers over a batch, classifying every question in one pass.
+
+        Returns the results in input order, None where no local tier was
+        confident enough, and the (position, timings) of those misses.
+        """
+        min_confidence = self.min_confidence if min_confidence is None else min_confidence
+        started = time.perf_counter()
+        subjects = self.classify_subjects(questions, session)
+        # The batched classification's cost, shared out over the questions
+        classify_ms = (time.perf_counter() - started) * 1000 / max(len(questions), 1)
+        results, misses = [], []
+        for position, (question, (subject, _)) in enumerate(zip(questions, subjects)):
+            timings = {'classify': classify_ms}
+            result = self.answer_local(question, min_confidence, timings, subject=subject, session=session)
+            results.append(result)
+            if result is None:
+                misses.append((position, timings))
+        return results, misses
+
+    def answer_batch(self, questions: List[str], min_confidence=None, max_concurrency=None,
+                     session: Optional[SessionState] = None) -> List[Dict]:
+        """answer_tiered for many questions at once, results in input order.
+
+        Local tiers run first over the whole batch; only the misses go to
+        Gemini, asking each distinct question (ignoring case and spacing)
+        once with up to max_concurrency (LIAM_BATCH_CONCURRENCY) calls in
+        flight.
+        """
+        results, misses = self.answer_local_batch(questions, min_confidence, session)
+        groups = defaultdict(list)
+        for position, timings in misses:
+            groups[fold_prompt(questions[position])].append((position, timings))
+        if not groups:
+            return results
+
+        def ask(group):
+            question = questions[group[0][0]]
+            started = time.perf_counter()
+            answer, _ = self.query_gemini(question, learn=True)
+            return answer, (time.perf_counter() - started) * 1000
+
+        limit = max_concurrency or int(os.getenv('LIAM_BATCH_CONCURRENCY', 16))
+        with ThreadPoolExecutor(max_workers=min(limit, len(groups)), thread_name_prefix='liam-batch') as executor:
+            for group, (answer, elapsed) in zip(groups.values(), executor.map(ask, groups.values())):
+                for position, timings in group:
+                    timings['gemini'] = elapsed
+                    results[position] = {'message': answer, 'tier': 'gemini', 'confidence': None, 'timings_ms': timings}
+        return results
+
+    def answer_stream(self, question, min_confidence=None,
+                      session: Optional[SessionState] = None) -> Iterator[Tuple[str, Dict]]:
+        """Streaming answer_tiered: yields ('chunk', {'text'}) events, then one 'done' or 'error'.
+
+        Local and cached answers arrive as a single chunk; Gemini answers are
+        streamed as they are generated and stored once the stream completes.
+        A caller asking while the same prompt is already being answered gets
+        that answer as a single chunk when it completes.
+        """
+        timings = {}
+        result = self.answer_local(question, self.min_confidence if min_confidence is None else min_confidence, timings,
+                                   session=session)
+        if result:
+            yield 'chunk', {'text': result.pop('message')}
+            yield 'done', result
+            return
+
+        started = time.perf_counter()
+        key = fold_prompt(question)
+        answer = self.answer_cache.get(question)
+        call = None if answer is not None else self.gemini_flight.lead(key)
+        if answer is not None:
+            yield 'chunk', {'text': answer}
+        elif call is not None:
+            try:
+                answer, _ = self.gemini_flight.wait(call)
+            except LLMError as e:
+                yield 'error', {'message': str(e)}
+                return
+            yield 'chunk', {'text': answer}
         else:
-            return str(response)
+            chunks = []
+            # Replaced on completion; followers see it if the client goes away mid-stream
+            error = LLMError("The answer stream was interrupted")
+            try:
+                for chunk in self.llm.stream(self.gemini_prompt(question)):
+                    if not chunks:
+                        timings['gemini_first_chunk'] = (time.perf_counter() - started) * 1000
+                    chunks.append(chunk)
+                    yield 'chunk', {'text': chunk}
+                answer = ''.join(chunks).strip()
+                self.answer_cache.put(question, answer)
+                self.store_learned_qa(question, answer)
+                error = None
+            except LLMError as e:
+                error = e
+            finally:
+                self.gemini_flight.finish(key, None if error else (answer, True), error)
+            if error:
+                yield 'error', {'message': str(error)}
+                return
+        self.remember_gemini_answer(question, answer, session)
+        timings['gemini'] = (time.perf_counter() - started) * 1000
+        yield 'done', {'tier': 'gemini', 'confidence': None, 'timings_ms': timings}
 
     def chat(self):
         """Enhanced chat interface with learning commands and memory."""
@@ -1070,34 +1764,32 @@ class EnhancedLearningQABot:
                 continue
 
             # Check for learned answer before calling Gemini
-            subject = self.classify_subject(user_input)
-            learned_answer = self.search_learned_responses(user_input, subject)
+            analysis = self.analyze(user_input)
+            learned_answer = self.search_learned_responses(user_input, analysis.subject)
             if learned_answer:
+                self.remember_learned_answer(user_input, learned_answer, analysis)
                 print(f"\n🤖 {self.name}: [From memory] {learned_answer}")
                 last_answer = learned_answer
                 last_question = user_input
             else:
                 # Use generate_response and fallback to Gemini if needed
                 if user_input:
-                    response, is_fallback = self.generate_response(user_input)
+                    response, is_fallback = self.generate_response(user_input, analysis=analysis)
                     if not is_fallback:
                         print(f"\n🤖 {self.name}: {response}")
                         last_answer = response
                         last_question = user_input
+                        # Ask Gemini in the background and store its answer for training
+                        self.training.submit(user_input)
                     else:
-                        gemini_answer = self.ask_gemini(user_input)
+                        gemini_answer, ok = self.query_gemini(user_input, learn=True)
+                        if ok:
+                            self.remember_gemini_answer(user_input, gemini_answer)
                         print(f"\n🤖 {self.name}: {gemini_answer}")
                         last_answer = gemini_answer
                         last_question = user_input
-                        self.store_learned_qa(user_input, gemini_answer)
                         print("\n💭 How was my answer? Type 'rate X' (1-5) to help me learn!")
 
-            # Always ask Gemini in the background and store the answer for training
-            def background_gemini_train(question):
-                gemini_answer = self.ask_gemini(question)
-                self.store_learned_qa(question, gemini_answer)
-            threading.Thread(target=background_gemini_train, args=(user_input,), daemon=True).start()
-
 # Run the enhanced chatbot
 if __name__ == "__main__":
     try:
@@ -1108,4 +1800,7 @@ if __name__ == "__main__":
         import numpy as np
     
     bot = EnhancedLearningQABot()
-    bot.chat()
\ No newline at end of file
+    try:
+        bot.chat()
+    finally:
+        bot.close()
\ No newline at end of file
@@ -0,0 +1,297 @@
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+
+class LLMError(Exception):
+    """Raised when the language model cannot produce an answer"""
+
+
+class GeminiBackend:
+    """google-generativeai backend; configured and bound to a model once"""
+
+    def __init__(self, model_name: str = 'gemini-1.5-flash', api_key: Optional[str] = None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    api_key = self.api_key or os.getenv("GEMINI_API_KEY")
+                    if not api_key:
+                        raise LLMError("Gemini API key not found. Please set GEMINI_API_KEY environment variable.")
+                    import google.generativeai as genai
+                    genai.configure(api_key=api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        response = self._get_model().generate_content(prompt, request_options={'timeout': timeout})
+        # The latest google-generativeai returns response.text or response.candidates[0].text
+        if hasattr(response, 'text'):
+            return response.text.strip()
+        elif hasattr(response, 'candidates') and response.candidates:
+            return response.candidates[0].text.strip()
+        else:
+            return str(response)
+
+    def stream(self, prompt: str, timeout: float) -> Iterator[str]:
+        response = self._get_model().generate_content(prompt, stream=True, request_options={'timeout': timeout})
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    async def generate_async(self, prompt: str, timeout: float) -> str:
+        response = await self._get_model().generate_content_async(prompt, request_options={'timeout': timeout})
+        return response.text.strip()
+
+    async def stream_async(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        response = await self._get_model().generate_content_async(prompt, stream=True,
+                                                                  request_options={'timeout': timeout})
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend:
+    """In-process stand-in for load testing without network access.
+
+    Each call sleeps for a latency drawn from ``distribution`` ('constant',
+    'uniform', 'exponential' or 'lognormal', all with the given mean), fails
+    with probability ``error_rate`` and times out like the real client when
+    the drawn latency exceeds the deadline.
+    """
+
+    def __init__(self, distribution: str = 'lognormal', mean: float = 0.4, spread: float = 0.5,
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        if distribution not in ('constant', 'uniform', 'exponential', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+        self.error_rate = error_rate
+        self.model_name = f"fake-{distribution}"
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            if self.distribution == 'constant':
+                return self.mean
+            if self.distribution == 'uniform':
+                return self._random.uniform(self.mean * (1 - self.spread), self.mean * (1 + self.spread))
+            if self.distribution == 'exponential':
+                return self._random.expovariate(1 / self.mean)
+            # lognormal with the requested mean: mu = ln(mean) - sigma^2 / 2
+            return self._random.lognormvariate(math.log(self.mean) - self.spread ** 2 / 2, self.spread)
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        latency = self.sample_latency()
+        if latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fake backend exceeded {timeout}s deadline")
+        time.sleep(latency)
+        if self._should_fail():
+            raise LLMError("fake backend error")
+        return self._answer(prompt)
+
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        question = prompt.rsplit('User question:', 1)[-1].strip()
+        return f"This is a simulated answer about: {question}"
+
+    def stream(self, prompt: str, timeout: float) -> Iterator[str]:
+        """Yield the answer word by word, the sampled latency split across the words"""
+        latency = self.sample_latency()
+        if latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fake backend exceeded {timeout}s deadline")
+        if self._should_fail():
+            raise LLMError("fake backend error")
+        words = self._answer(prompt).split(' ')
+        for position, word in enumerate(words):
+            time.sleep(latency / len(words))
+            yield word if position == 0 else ' ' + word
+
+    async def generate_async(self, prompt: str, timeout: float) -> str:
+        latency = self.sample_latency()
+        await asyncio.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"fake backend exceeded {timeout}s deadline")
+        if self._should_fail():
+            raise LLMError("fake backend error")
+        return self._answer(prompt)
+
+    async def stream_async(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        latency = self.sample_latency()
+        if latency > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError(f"fake backend exceeded {timeout}s deadline")
+        if self._should_fail():
+            raise LLMError("fake backend error")
+        words = self._answer(prompt).split(' ')
+        for position, word in enumerate(words):
+            await asyncio.sleep(latency / len(words))
+            yield word if position == 0 else ' ' + word
+
+
+class LLMClient:
+    """Process-wide LLM client with a per-call deadline and call counters"""
+
+    def __init__(self, backend, timeout: float = 30.0):
+        self.backend = backend
+        self.timeout = timeout
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+        self.first_chunk_latency = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.model_name
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Return the model's answer, raising LLMError on failure or deadline"""
+        deadline = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        try:
+            return self.backend.generate(prompt, deadline)
+        except LLMError as e:
+            raise self._failure(e)
+        except Exception as e:
+            raise self._failure(e) from e
+        finally:
+            self._count_call(started)
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield the answer in chunks as the model produces them.
+
+        The deadline applies to the whole response; latency is counted to the
+        last chunk and first_chunk_latency records the time to the first one.
+        """
+        deadline = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        first = True
+        try:
+            for chunk in self.backend.stream(prompt, deadline):
+                if first:
+                    first = False
+                    with self._lock:
+                        self.first_chunk_latency = time.perf_counter() - started
+                yield chunk
+        except LLMError as e:
+            raise self._failure(e)
+        except Exception as e:
+            raise self._failure(e) from e
+        finally:
+            self._count_call(started)
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """generate() for event loops: waits on the network without holding a thread"""
+        deadline = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self.backend.generate_async(prompt, deadline), deadline)
+        except LLMError as e:
+            raise self._failure(e)
+        except asyncio.TimeoutError as e:
+            raise self._failure(TimeoutError(f"no answer within {deadline}s")) from e
+        except Exception as e:
+            raise self._failure(e) from e
+        finally:
+            self._count_call(started)
+
+    async def stream_async(self, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """stream() for event loops; the deadline covers the whole response"""
+        deadline = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        first = True
+        chunks = self.backend.stream_async(prompt, deadline).__aiter__()
+        try:
+            while True:
+                remaining = deadline - (time.perf_counter() - started)
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(remaining, 0))
+                except StopAsyncIteration:
+                    break
+                if first:
+                    first = False
+                    with self._lock:
+                        self.first_chunk_latency = time.perf_counter() - started
+                yield chunk
+        except LLMError as e:
+            raise self._failure(e)
+        except asyncio.TimeoutError as e:
+            raise self._failure(TimeoutError(f"no answer within {deadline}s")) from e
+        except Exception as e:
+            raise self._failure(e) from e
+        finally:
+            self._count_call(started)
+
+    def _count_call(self, started: float):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self.total_latency += elapsed
+            self.last_latency = elapsed
+
+    def _failure(self, e: Exception) -> LLMError:
+        """Count a failed call and wrap backend errors as LLMError"""
+        timed_out = isinstance(e, TimeoutError) or 'deadline' in str(e).lower() or 'timeout' in str(e).lower()
+        with self._lock:
+            self.errors += 1
+            if timed_out:
+                self.timeouts += 1
+        return e if isinstance(e, LLMError) else LLMError(f"{'Timed out' if timed_out else 'Request failed'}: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'model': self.model_name,
+                'calls': self.calls,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'average_latency': self.total_latency / self.calls if self.calls else 0.0,
+                'last_latency': self.last_latency,
+                'first_chunk_latency': self.first_chunk_latency
+            }
+
+
+def create_client_from_env() -> LLMClient:
+    """Build a client from LIAM_LLM_BACKEND, LIAM_LLM_MODEL, LIAM_LLM_TIMEOUT and LIAM_FAKE_LATENCY"""
+    timeout = float(os.getenv('LIAM_LLM_TIMEOUT', 30))
+    if os.getenv('LIAM_LLM_BACKEND', 'gemini') == 'fake':
+        # e.g. LIAM_FAKE_LATENCY=lognormal:0.4:0.5
+        distribution, mean, spread = (os.getenv('LIAM_FAKE_LATENCY', 'lognormal:0.4:0.5').split(':') + ['0.5'])[:3]
+        backend = FakeBackend(distribution, float(mean), float(spread),
+                              error_rate=float(os.getenv('LIAM_FAKE_ERROR_RATE', 0)))
+    else:
+        backend = GeminiBackend(os.getenv('LIAM_LLM_MODEL', 'gemini-1.5-flash'))
+    return LLMClient(backend, timeout=timeout)
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def default_client() -> LLMClient:
+    """Return the client shared by every bot in this process"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = create_client_from_env()
+        return _default_client
@@ -0,0 +1,355 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: the store is then safe for a single process only
+    fcntl = None
+
+
+class JournalStore:
+    """Snapshot file plus an append-only JSONL journal of state changes.
+
+    Every change is appended as one JSON line and flushed, so a crash loses at
+    most the record being written. compact() atomically replaces the snapshot
+    with the full state and starts a new, empty journal. Each journal begins
+    with a header naming the snapshot generation it extends, which lets load()
+    ignore a journal left over from a compaction that was interrupted after
+    the snapshot was replaced.
+
+    Several processes can share one store. Appends and compactions hold an
+    exclusive flock, and every record is tagged with the writing process's
+    origin. poll() tails the journal from the last byte applied and returns
+    the records other processes wrote. A compaction keeps the records from
+    other processes that its snapshot does not include. If another process
+    compacted first, the compaction is abandoned.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None,
+                 compact_every: int = 1000, fsync: bool = False):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + '.journal.jsonl'
+        self.lock_path = os.path.splitext(snapshot_path)[0] + '.lock'
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.origin = uuid.uuid4().hex[:12]
+        self.generation = 0
+        self.pending = 0
+        self.offset = 0  # journal bytes already applied to the caller's state
+        self._encoded_offset = 0
+        self._seen = None  # journal (size, mtime) at the last poll that read everything
+        self._journal = None
+        self._lock_file = None
+        self._mutex = threading.RLock()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the journal across threads and processes"""
+        with self._mutex:
+            if fcntl is None:
+                yield
+                return
+            if self._lock_file is None:
+                self._lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.pending >= self.compact_every
+
+    def load(self) -> Tuple[Optional[Dict], List[Dict]]:
+        """Return the snapshot (or None) and the journal records to replay on top of it"""
+        with self._locked():
+            snapshot = None
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r') as f:
+                    snapshot = json.load(f)
+            self.generation = snapshot.get('generation', 0) if snapshot else 0
+
+            records = []
+            self.offset = 0
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb') as f:
+                    lines = f.readlines()
+                if lines and not lines[-1].endswith(b'\n'):
+                    # Drop a torn final record so the next append starts on a fresh line
+                    torn = lines.pop()
+                    with open(self.journal_path, 'r+') as f:
+                        f.truncate(os.path.getsize(self.journal_path) - len(torn))
+                header = self._parse(lines[0]) if lines else None
+                if header is not None and header.get('generation') == self.generation:
+                    for line in lines[1:]:
+                        record = self._parse(line)
+                        if record is not None:
+                            records.append(record)
+                    self.offset = sum(len(line) for line in lines)
+                else:
+                    # Stale journal from before the current snapshot; start over
+                    self.offset = self._start_journal()
+            self._seen = None
+            self.pending = len(records)
+            return snapshot, records
+
+    def poll(self) -> Optional[List[Dict]]:
+        """Return records other processes appended since the last load() or poll().
+
+        Returns None when the journal now extends a newer snapshot written by
+        another process; the caller must then load() again. Unchanged files
+        cost one stat() call.
+        """
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return []
+        if (stat.st_size, stat.st_mtime_ns) == self._seen:
+            return []
+        with self._locked():
+            with open(self.journal_path, 'rb') as f:
+                header = self._parse(f.readline())
+                if header is None or header.get('generation') != self.generation:
+                    return None
+                stat = os.fstat(f.fileno())
+                f.seek(self.offset)
+                data = f.read()
+            complete = data.rfind(b'\n') + 1
+            records = [record for record in map(self._parse, data[:complete].splitlines())
+                       if self._is_foreign(record)]
+            self.offset += complete
+            self.pending += len(records)
+            self._seen = (stat.st_size, stat.st_mtime_ns) if complete == len(data) else None
+            return records
+
+    @staticmethod
+    def _parse(line: str) -> Optional[Dict]:
+        try:
+            return json.loads(line)
+        except ValueError:
+            # A torn final line after a crash
+            return None
+
+    def _is_foreign(self, record: Optional[Dict]) -> bool:
+        """A change record (not a header) written by another process"""
+        return record is not None and 'op' in record and record.get('origin') != self.origin
+
+    def _open(self):
+        if self._journal is None:
+            if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+                self.offset = self._start_journal()
+            self._journal = open(self.journal_path, 'ab')
+        return self._journal
+
+    def _start_journal(self, generation: Optional[int] = None, carried: List[bytes] = ()) -> int:
+        """Rewrite the journal as a header plus carried lines; returns the header's length"""
+        self._close_journal()
+        header = (json.dumps({'generation': self.generation if generation is None else generation}) + '\n').encode()
+        with open(self.journal_path, 'wb') as f:
+            f.write(header + b''.join(carried))
+        return len(header)
+
+    def append(self, record: Dict):
+        """Durably append one change record"""
+        self.append_many([json.dumps(record)])
+
+    def append_many(self, encoded: List[str]):
+        """Append JSON-encoded change records with a single flush"""
+        with self._locked():
+            journal = self._open()
+            size = os.fstat(journal.fileno()).st_size
+            journal.write(''.join(line + '\n' for line in encoded).encode())
+            journal.flush()
+            if self.fsync:
+                os.fsync(journal.fileno())
+            if size == self.offset:
+                # Nothing from other processes in between: our own records need no polling
+                self.offset = os.fstat(journal.fileno()).st_size
+            self.pending += len(encoded)
+
+    def encode_snapshot(self, state: Dict) -> Tuple[int, str]:
+        """Serialize state as the next snapshot generation.
+
+        state must include every record applied so far (the journal up to offset).
+        """
+        with self._mutex:
+            self._encoded_offset = self.offset
+            return self.generation + 1, json.dumps(dict(state, generation=self.generation + 1))
+
+    def write_snapshot(self, generation: int, encoded: str, covered: List[str] = ()) -> bool:
+        """Atomically replace the snapshot and start that generation's journal.
+
+        covered holds the encoded changes the snapshot already includes.
+        Returns False, writing nothing, if another process compacted since
+        the snapshot was encoded.
+        """
+        with self._locked():
+            carried, applied = [], 0
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb') as f:
+                    header = self._parse(f.readline())
+                    if header is not None and header.get('generation') != generation - 1:
+                        return False
+                    f.seek(self._encoded_offset)
+                    data = f.read()
+                # Other processes' records after the encoded point are not in the snapshot
+                position = self._encoded_offset
+                for line in data[:data.rfind(b'\n') + 1].splitlines(keepends=True):
+                    if self._is_foreign(self._parse(line)):
+                        carried.append(line)
+                        if position < self.offset:
+                            applied += len(line)
+                    position += len(line)
+            write_atomic(self.snapshot_path, encoded)
+            self.offset = self._start_journal(generation, carried) + applied
+            self.generation = generation
+            self.pending = len(carried)
+            self._seen = None
+            return True
+
+    def compact(self, state: Dict):
+        """Atomically write state as the new snapshot and reset the journal"""
+        self.write_snapshot(*self.encode_snapshot(state))
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def close(self):
+        with self._mutex:
+            self._close_journal()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+
+def write_atomic(path: str, data):
+    """Write JSON (or pre-encoded JSON text) to path via a temp file, fsync and rename"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        if isinstance(data, str):
+            f.write(data)
+        else:
+            json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BackgroundWriter:
+    """Runs a store's disk writes on a dedicated thread.
+
+    append() and compact() only buffer work and return; the writer thread
+    coalesces everything buffered into at most one batch per ``interval``
+    seconds. A queued snapshot supersedes the changes buffered before it.
+    Changes and snapshots are serialized on the calling thread so they
+    reflect a single point in time; only the I/O happens in the background. Buffered work is
+    flushed on close(), which is also registered with atexit. With a non-zero
+    interval a crash can lose up to that many seconds of changes.
+    """
+
+    def __init__(self, store, interval: float = 1.0):
+        self.store = store
+        self.interval = interval
+        self.last_save_latency = 0.0
+        self.saves = 0
+        self._cond = threading.Condition()
+        self._records = []
+        self._snapshot = None
+        self._covered = []
+        self._writing = False
+        self._flushing = False
+        self._closed = False
+        self._last_write = 0.0
+        self._thread = threading.Thread(target=self._run, name='liam-persistence', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending_saves(self) -> int:
+        """Changes and snapshots waiting to be written"""
+        with self._cond:
+            return len(self._records) + (1 if self._snapshot else 0)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._snapshot is None and self.store.needs_compaction
+
+    def append(self, change: Dict):
+        # Tagged so other processes sharing the store can tell whose change it is
+        encoded = json.dumps(dict(change, origin=self.store.origin))
+        with self._cond:
+            self._records.append(encoded)
+            self._cond.notify_all()
+
+    def compact(self, state: Dict):
+        encoded = self.store.encode_snapshot(state)
+        with self._cond:
+            # Everything buffered so far is part of this snapshot; keep it in
+            # case the store rejects the snapshot
+            self._covered.extend(self._records)
+            self._records = []
+            self._snapshot = encoded
+            self._cond.notify_all()
+
+    def _idle(self) -> bool:
+        return not self._records and self._snapshot is None and not self._writing
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write everything buffered now; returns False on timeout"""
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            done = self._cond.wait_for(self._idle, timeout)
+            self._flushing = False
+            return done
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.store.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or not self._idle())
+                if self._closed and self._idle():
+                    return
+                # Coalesce: wait until interval has passed since the last write
+                delay = self._last_write + self.interval - time.monotonic()
+                if delay > 0:
+                    self._cond.wait_for(lambda: self._flushing or self._closed, delay)
+                records, self._records = self._records, []
+                snapshot, self._snapshot = self._snapshot, None
+                covered, self._covered = self._covered, []
+                self._writing = True
+            started = time.perf_counter()
+            try:
+                if snapshot is not None and not self.store.write_snapshot(*snapshot, covered):
+                    # Another process compacted first; journal the changes instead
+                    records = covered + records
+                if records:
+                    self.store.append_many(records)
+            except Exception as e:
+                print(f"Error saving data: {e}")
+            finally:
+                with self._cond:
+                    self.last_save_latency = time.perf_counter() - started
+                    self.saves += 1
+                    self._last_write = time.monotonic()
+                    self._writing = False
+                    self._cond.notify_all()
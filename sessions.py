@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def valid_session_id(session_id) -> Optional[str]:
+    """session_id if it is a plausible id from a client, else None (so a new session is started)"""
+    if isinstance(session_id, str) and 0 < len(session_id) <= 64 and session_id.isprintable():
+        return session_id
+    return None
+
+
+class SessionState:
+    """One user's conversation state: recent context, style preferences and the last answer.
+
+    Context holds at most context_size (question, subject) pairs, so the
+    memory a session can use is bounded.
+    """
+
+    __slots__ = ('session_id', 'context_size', 'context', 'preferences', 'last_interaction', 'last_seen')
+
+    def __init__(self, session_id: str, context_size: int = 10):
+        self.session_id = session_id
+        self.context_size = context_size
+        # A short list is far smaller than a deque, which allocates 64 slots up front
+        self.context = []
+        self.preferences = None  # pref key -> counters, created on the first rating
+        self.last_interaction = None  # question, response, subject and keywords of the last answer
+        self.last_seen = time.monotonic()
+
+    def add_context(self, question: str, subject: str):
+        self.context.append((question, subject))
+        if len(self.context) > self.context_size:
+            del self.context[0]
+
+    def recent_subjects(self, count: int):
+        return [subject for _, subject in self.context[-count:]]
+
+    def prefer(self, key: str, fields):
+        if self.preferences is None:
+            self.preferences = {}
+        counters = self.preferences.setdefault(key, {'detailed': 0, 'concise': 0, 'examples': 0})
+        for field in fields:
+            counters[field] += 1
+
+
+class SessionTable:
+    """Sessions by id, evicted when idle for ttl seconds or beyond max_sessions (least recent first).
+
+    max_sessions times the per-session bound caps the table's memory.
+    Expired sessions are dropped as get() walks the oldest end of the LRU
+    order, so eviction costs O(1) amortized and needs no sweeper thread.
+    """
+
+    def __init__(self, max_sessions: int = 100000, ttl: float = 1800, context_size: int = 10):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.context_size = context_size
+        self.sessions = OrderedDict()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id: Optional[str] = None) -> SessionState:
+        """The session for session_id, created if unknown or expired; a new id if None"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self.sessions.get(session_id) if session_id else None
+            if session is None:
+                session = SessionState(session_id or uuid.uuid4().hex, self.context_size)
+                self.sessions[session.session_id] = session
+                self.created += 1
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self.sessions.move_to_end(session_id)
+            session.last_seen = now
+            return session
+
+    def _expire(self, now: float):
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if now - oldest.last_seen <= self.ttl:
+                return
+            self.sessions.popitem(last=False)
+            self.expired += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'active': len(self.sessions),
+                'max_sessions': self.max_sessions,
+                'created': self.created,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
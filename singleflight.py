@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class _Call:
+    """One in-flight call that followers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one upstream call.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    while it is in flight wait and receive the same result or exception.
+    Nothing is kept once the call completes, so a later caller starts a
+    fresh call and never sees a stale result. Thread callers use do() or
+    lead()/finish(); coroutines use do_async() or lead_async()/finish_async(),
+    which coalesce only with other coroutines on the same event loop.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def lead(self, key: str) -> Optional[_Call]:
+        """None if the caller now leads key's call and must finish() it, else the call to wait on"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call
+            self._calls[key] = _Call()
+            self.leaders += 1
+            return None
+
+    def finish(self, key: str, result: Any = None, error: Optional[BaseException] = None):
+        """Complete the call lead() handed to this caller, waking its followers"""
+        with self._lock:
+            call = self._calls.pop(key)
+        call.result, call.error = result, error
+        call.done.set()
+
+    @staticmethod
+    def wait(call: _Call) -> Any:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        """Return func(), sharing one call among concurrent callers with the same key"""
+        call = self.lead(key)
+        if call is not None:
+            return self.wait(call)
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
+
+    def lead_async(self, key: str) -> Optional[asyncio.Future]:
+        """lead() for coroutines: None if the caller leads, else a future to await"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get((loop, key))
+            if future is not None:
+                self.coalesced += 1
+                return future
+            self._futures[(loop, key)] = loop.create_future()
+            self.leaders += 1
+            return None
+
+    def finish_async(self, key: str, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            future = self._futures.pop((asyncio.get_running_loop(), key))
+        if error is not None:
+            future.set_exception(error)
+            # Mark retrieved so a call without followers logs no "exception never retrieved"
+            future.exception()
+        else:
+            future.set_result(result)
+
+    async def do_async(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await factory(), sharing one call among concurrent coroutines with the same key"""
+        future = self.lead_async(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        try:
+            result = await factory()
+        except BaseException as e:
+            self.finish_async(key, error=e)
+            raise
+        self.finish_async(key, result)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                'upstream_calls': self.leaders,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls) + len(self._futures),
+                'coalesced_rate': self.coalesced / calls if calls else 0.0
+            }
@@ -0,0 +1,304 @@
+import json
+import queue
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bounded import append_bounded
+from text_index import tokenize_text
+
+# Changes materialized into their own tables instead of the change log
+TABLE_OPS = {'history', 'history_feedback', 'learned_added', 'learned_rated', 'learned_removed',
+             'correction', 'corrections_removed', 'success'}
+TABLE_FIELDS = ('conversation_history', 'learned_responses', 'correction_memory', 'success_patterns')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY, change TEXT NOT NULL, origin TEXT);
+CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, question TEXT NOT NULL, entry TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS learned (id INTEGER PRIMARY KEY, subject TEXT NOT NULL, question TEXT NOT NULL, item TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS learned_subject ON learned (subject, id);
+CREATE TABLE IF NOT EXISTS corrections (id INTEGER PRIMARY KEY, subject TEXT NOT NULL, record TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS corrections_subject ON corrections (subject, id);
+CREATE TABLE IF NOT EXISTS success_patterns (id INTEGER PRIMARY KEY, pattern_key TEXT NOT NULL, record TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS success_patterns_key ON success_patterns (pattern_key, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(question, content='history', content_rowid='id');
+"""
+
+
+def fts_query(tokens: Iterable[str]) -> Optional[str]:
+    """OR together quoted tokens so any shared word makes a candidate"""
+    terms = ['"{}"'.format(token.replace('"', '""')) for token in dict.fromkeys(tokens)]
+    return ' OR '.join(terms) if terms else None
+
+
+def jaccard(tokens1: Iterable[str], tokens2: Iterable[str]) -> float:
+    set1, set2 = set(tokens1), set(tokens2)
+    if not set1 or not set2:
+        return 0.0
+    return len(set1 & set2) / len(set1 | set2)
+
+
+class SQLiteStore:
+    """SQLite storage backend with the same interface as JournalStore.
+
+    conversation_history, learned_responses, correction_memory and
+    success_patterns live in their own tables and are never truncated; the
+    remaining state is a snapshot row plus a change log, compacted like the
+    JSON journal. Only the most recent history_window conversations are
+    loaded into memory; similar-question lookups run over the full history
+    through an FTS5 index and re-rank the candidates with Jaccard. The
+    database runs in WAL mode and is shared through a small connection pool.
+
+    Worker processes can share one database. Every change, including the
+    ones materialized into tables, is also logged in the change table with
+    its origin. poll() returns the changes logged by other processes since
+    the last load() or poll(). A compaction removes only the changes its
+    snapshot includes. If another process compacted first, it is abandoned.
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000, pool_size: int = 4,
+                 history_window: int = 100, candidate_limit: int = 500):
+        self.path = path
+        self.compact_every = compact_every
+        self.history_window = history_window
+        self.candidate_limit = candidate_limit
+        self.origin = uuid.uuid4().hex[:12]
+        self.generation = 0
+        self.pending = 0
+        self.last_id = 0  # highest change id applied to the caller's state
+        self._encoded_id = 0
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._pool.put(conn)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            if 'origin' not in [column[1] for column in conn.execute("PRAGMA table_info(changes)")]:
+                conn.execute("ALTER TABLE changes ADD COLUMN origin TEXT")
+            row = conn.execute("SELECT value FROM state WHERE key = 'snapshot'").fetchone()
+            if row:
+                # Databases from before the generation row existed
+                conn.execute("INSERT OR IGNORE INTO state (key, value) VALUES ('generation', ?)",
+                             (str(json.loads(row[0]).get('generation', 0)),))
+
+    @contextmanager
+    def _connection(self):
+        """Borrow a pooled connection; commits on success, rolls back on error"""
+        conn = self._pool.get()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._pool.put(conn)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.pending >= self.compact_every
+
+    def load(self) -> Tuple[Optional[Dict], List[Dict]]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT value FROM state WHERE key = 'snapshot'").fetchone()
+            snapshot = json.loads(row[0]) if row else {}
+            self.generation = snapshot.get('generation', 0)
+            self.last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+
+            history = conn.execute("SELECT entry FROM history ORDER BY id DESC LIMIT ?",
+                                   (self.history_window,)).fetchall()
+            snapshot['conversation_history'] = [json.loads(entry) for (entry,) in reversed(history)]
+
+            learned = {}
+            for subject, item in conn.execute("SELECT subject, item FROM learned ORDER BY id"):
+                learned.setdefault(subject, []).append(json.loads(item))
+            snapshot['learned_responses'] = learned
+
+            corrections = {}
+            for subject, record in conn.execute("SELECT subject, record FROM corrections ORDER BY id"):
+                corrections.setdefault(subject, []).append(json.loads(record))
+            snapshot['correction_memory'] = corrections
+
+            patterns = {}
+            for pattern_key, record in conn.execute("SELECT pattern_key, record FROM success_patterns ORDER BY id"):
+                patterns.setdefault(pattern_key, []).append(json.loads(record))
+            snapshot['success_patterns'] = patterns
+
+            # Changes to the tables above are already materialized there
+            records = [record for record in (json.loads(change) for (change,) in
+                                             conn.execute("SELECT change FROM changes WHERE id <= ? ORDER BY id",
+                                                          (self.last_id,)))
+                       if record['op'] not in TABLE_OPS]
+        self.pending = len(records)
+        return snapshot, records
+
+    def poll(self) -> Optional[List[Dict]]:
+        """Return changes other processes logged since the last load() or poll().
+
+        Returns None when another process has written a newer snapshot; the
+        caller must then load() again.
+        """
+        with self._connection() as conn:
+            row = conn.execute("SELECT value FROM state WHERE key = 'generation'").fetchone()
+            if int(row[0] if row else 0) != self.generation:
+                return None
+            rows = conn.execute("SELECT id, change, origin FROM changes WHERE id > ? ORDER BY id",
+                                (self.last_id,)).fetchall()
+        records = []
+        for row_id, change, origin in rows:
+            self.last_id = row_id
+            if origin != self.origin:
+                record = json.loads(change)
+                records.append(record)
+                if record['op'] not in TABLE_OPS:
+                    self.pending += 1
+        return records
+
+    def append(self, change: Dict):
+        self.append_many([json.dumps(change)])
+
+    def append_many(self, encoded: List[str]):
+        """Write a batch of JSON-encoded changes in one transaction"""
+        with self._connection() as conn:
+            for text in encoded:
+                self._write_change(conn, json.loads(text), text)
+
+    def _write_change(self, conn, change: Dict, text: str):
+        op = change['op']
+        cursor = conn.execute("INSERT INTO changes (change, origin) VALUES (?, ?)", (text, change.get('origin')))
+        if cursor.lastrowid == self.last_id + 1:
+            # Nothing from other processes in between: our own changes need no polling
+            self.last_id = cursor.lastrowid
+        if op not in TABLE_OPS:
+            self.pending += 1
+        elif op == 'history':
+            entry = change['entry']
+            cursor = conn.execute("INSERT INTO history (question, entry) VALUES (?, ?)",
+                                  (entry['question'], json.dumps(entry)))
+            conn.execute("INSERT INTO history_fts (rowid, question) VALUES (?, ?)",
+                         (cursor.lastrowid, entry['question']))
+        elif op == 'history_feedback':
+            if 'question' in change:
+                row = conn.execute("SELECT id, entry FROM history WHERE question = ? ORDER BY id DESC LIMIT 1",
+                                   (change['question'],)).fetchone()
+            else:
+                row = conn.execute("SELECT id, entry FROM history ORDER BY id DESC LIMIT 1").fetchone()
+            if row:
+                entry = json.loads(row[1])
+                entry['feedback'] = change['rating']
+                conn.execute("UPDATE history SET entry = ? WHERE id = ?", (json.dumps(entry), row[0]))
+        elif op == 'learned_added':
+            item = change['item']
+            conn.execute("INSERT INTO learned (subject, question, item) VALUES (?, ?, ?)",
+                         (change['subject'], item['question'], json.dumps(item)))
+        elif op == 'learned_rated':
+            row = conn.execute("SELECT id, item FROM learned WHERE subject = ? AND question = ? ORDER BY id LIMIT 1",
+                               (change['subject'], change['question'])).fetchone()
+            if row:
+                row_id, item = row[0], json.loads(row[1])
+                append_bounded(item['feedback_scores'], change['rating'], change.get('keep'))
+                item['avg_feedback'] = sum(item['feedback_scores']) / len(item['feedback_scores'])
+                item['usage_count'] += 1
+                conn.execute("UPDATE learned SET item = ? WHERE id = ?", (json.dumps(item), row_id))
+        elif op == 'learned_removed':
+            if 'dates' in change:
+                keys = set(zip(change['questions'], change['dates']))
+                removed = lambda item: (item['question'], item.get('learned_date')) in keys
+            else:
+                questions = set(change['questions'])
+                removed = lambda item: item['question'] in questions
+            for row_id, item in self._rows(conn, 'learned', 'item', change['subject']):
+                if removed(item):
+                    conn.execute("DELETE FROM learned WHERE id = ?", (row_id,))
+        elif op == 'correction':
+            conn.execute("INSERT INTO corrections (subject, record) VALUES (?, ?)",
+                         (change['subject'], json.dumps(change['record'])))
+            if change.get('keep'):
+                conn.execute("DELETE FROM corrections WHERE subject = ? AND id NOT IN "
+                             "(SELECT id FROM corrections WHERE subject = ? ORDER BY id DESC LIMIT ?)",
+                             (change['subject'], change['subject'], change['keep']))
+        elif op == 'corrections_removed':
+            questions = set(change['questions'])
+            for row_id, record in self._rows(conn, 'corrections', 'record', change['subject']):
+                if record['question'] in questions:
+                    conn.execute("DELETE FROM corrections WHERE id = ?", (row_id,))
+        elif op == 'success':
+            conn.execute("INSERT INTO success_patterns (pattern_key, record) VALUES (?, ?)",
+                         (change['key'], json.dumps(change['record'])))
+            if change.get('keep'):
+                conn.execute("DELETE FROM success_patterns WHERE pattern_key = ? AND id NOT IN "
+                             "(SELECT id FROM success_patterns WHERE pattern_key = ? ORDER BY id DESC LIMIT ?)",
+                             (change['key'], change['key'], change['keep']))
+
+    @staticmethod
+    def _rows(conn, table: str, column: str, subject: str):
+        rows = conn.execute(f"SELECT id, {column} FROM {table} WHERE subject = ? ORDER BY id", (subject,)).fetchall()
+        return [(row_id, json.loads(value)) for row_id, value in rows]
+
+    def encode_snapshot(self, state: Dict) -> Tuple[int, str]:
+        """Serialize the non-table state as the next snapshot.
+
+        state must include every change applied so far (up to last_id).
+        """
+        self._encoded_id = self.last_id
+        snapshot = {key: value for key, value in state.items() if key not in TABLE_FIELDS}
+        snapshot['generation'] = self.generation + 1
+        return self.generation + 1, json.dumps(snapshot)
+
+    def write_snapshot(self, generation: int, encoded: str, covered: List[str] = ()) -> bool:
+        """Replace the snapshot row and drop the changes it includes in one transaction.
+
+        covered holds encoded changes made before the snapshot that were
+        never written; those to the tables are written here, since the
+        snapshot leaves the tables out. Returns False, writing nothing, if
+        another process compacted since the snapshot was encoded.
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM state WHERE key = 'generation'").fetchone()
+            if int(row[0] if row else 0) != generation - 1:
+                return False
+            for text in covered:
+                change = json.loads(text)
+                if change['op'] in TABLE_OPS:
+                    self._write_change(conn, change, text)
+            conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('snapshot', ?)", (encoded,))
+            conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('generation', ?)", (str(generation),))
+            # Other processes' later changes stay for them and for the next load()
+            conn.execute("DELETE FROM changes WHERE id <= ? OR origin = ?", (self._encoded_id, self.origin))
+            remaining = conn.execute("SELECT id, change FROM changes").fetchall()
+        self.generation = generation
+        # Deleted ids can be reused; new changes get ids above the highest remaining one
+        self.last_id = min(self.last_id, max((row_id for row_id, _ in remaining), default=0))
+        remaining = [json.loads(change)['op'] for _, change in remaining]
+        self.pending = sum(1 for op in remaining if op not in TABLE_OPS)
+        return True
+
+    def compact(self, state: Dict):
+        self.write_snapshot(*self.encode_snapshot(state))
+
+    def similar_history(self, question: str, threshold: float = 0.3, top_k: Optional[int] = None,
+                        tokens: Optional[Tuple[str, ...]] = None) -> List[Tuple[Dict, float]]:
+        """Return (entry, jaccard) over the whole stored history, best first"""
+        tokens = tokenize_text(question) if tokens is None else tokens
+        match = fts_query(tokens)
+        if match is None:
+            return []
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT history.id, history.entry FROM history_fts JOIN history ON history.id = history_fts.rowid "
+                "WHERE history_fts MATCH ? ORDER BY bm25(history_fts) LIMIT ?",
+                (match, self.candidate_limit)).fetchall()
+        scored = []
+        for row_id, entry in rows:
+            entry = json.loads(entry)
+            similarity = jaccard(tokens, tokenize_text(entry['question']))
+            if similarity >= threshold:
+                scored.append((row_id, entry, similarity))
+        scored.sort(key=lambda match: (-match[2], match[0]))
+        return [(entry, similarity) for _, entry, similarity in scored[:top_k]]
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().close()
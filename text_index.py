@@ -0,0 +1,460 @@
+import re
+import heapq
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+_PUNCTUATION = re.compile(r'[^\w\s\?\!]')
+
+
+@lru_cache(maxsize=4096)
+def tokenize_text(text: str) -> Tuple[str, ...]:
+    """Normalize text into tokens without touching any learning state.
+
+    Pure and memoized per text; callers that need a mutable list must copy.
+    """
+    text = _PUNCTUATION.sub(' ', text.lower())
+    return tuple(word for word in text.split() if len(word) > 2)
+
+
+class TokenIndex:
+    """Inverted index (token -> document ids) with cached token-set sizes.
+
+    Jaccard similarity is computed exactly, but only for documents sharing at
+    least one token with the query, so a lookup costs the size of the posting
+    lists it touches instead of the number of indexed documents.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.doc_tokens: Dict[int, FrozenSet[str]] = {}
+        self.sizes: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.sizes
+
+    def add(self, doc_id: int, tokens: Iterable[str]):
+        """Index a document, replacing any previous version with the same id"""
+        if doc_id in self.sizes:
+            self.remove(doc_id)
+        token_set = frozenset(tokens)
+        self.doc_tokens[doc_id] = token_set
+        self.sizes[doc_id] = len(token_set)
+        for token in token_set:
+            self.postings[token].add(doc_id)
+
+    def remove(self, doc_id: int):
+        """Drop a document from the index"""
+        token_set = self.doc_tokens.pop(doc_id, None)
+        if token_set is None:
+            return
+        del self.sizes[doc_id]
+        for token in token_set:
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self.postings[token]
+
+    def clear(self):
+        self.postings.clear()
+        self.doc_tokens.clear()
+        self.sizes.clear()
+
+    def query(self, tokens: Iterable[str], threshold: float = 0.0,
+              top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return (doc_id, jaccard) pairs with jaccard >= threshold.
+
+        Results are ordered by similarity (highest first) and then by doc id,
+        which matches a stable sort over documents in insertion order.
+        """
+        query_set = set(tokens)
+        query_size = len(query_set)
+
+        overlaps = defaultdict(int)
+        for token in query_set:
+            for doc_id in self.postings.get(token, ()):
+                overlaps[doc_id] += 1
+
+        scored = []
+        if threshold <= 0:
+            # Documents without any shared token score 0.0 and still qualify
+            scored = [(doc_id, 0.0) for doc_id in self.sizes if doc_id not in overlaps]
+
+        for doc_id, overlap in overlaps.items():
+            doc_size = self.sizes[doc_id]
+            similarity = overlap / (query_size + doc_size - overlap)
+            if similarity >= threshold:
+                scored.append((doc_id, similarity))
+
+        def order(item):
+            return (-item[1], item[0])
+
+        if top_k is not None:
+            return heapq.nsmallest(top_k, scored, key=order)
+        return sorted(scored, key=order)
+
+
+class MinHashLSH:
+    """MinHash signatures with LSH banding for Jaccard candidate retrieval.
+
+    With ``rows`` hashes per band, two sets of Jaccard similarity ``s`` become
+    candidates with probability ``1 - (1 - s**rows) ** bands``, which turns up
+    around ``(1 / bands) ** (1 / rows)``. The defaults (256 permutations, 64
+    bands of 4 rows) put that knee at 0.35, just under the 0.4-0.7 range the
+    bot uses: a pair at s=0.4 is found 81% of the time, at 0.5 98% and at 0.7
+    always, while pairs sharing only a word or two such as "what" or "the"
+    rarely collide. Pairs without any shared token never do.
+    """
+
+    _PRIME = (1 << 31) - 1
+
+    def __init__(self, num_perm: int = 256, rows: int = 4, seed: int = 1):
+        if num_perm % rows:
+            raise ValueError("num_perm must be a multiple of rows")
+        self.num_perm = num_perm
+        self.rows = rows
+        self.bands = num_perm // rows
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, self._PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, self._PRIME, size=num_perm).astype(np.uint64)
+        self.buckets = [defaultdict(set) for _ in range(self.bands)]
+        self.band_keys = {}
+
+    def signature(self, tokens: Iterable[str]) -> Optional[np.ndarray]:
+        """Return the MinHash signature of a token set, or None if it is empty"""
+        token_set = set(tokens)
+        if not token_set:
+            return None
+        hashes = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in token_set),
+                             dtype=np.uint64, count=len(token_set))
+        permuted = (np.outer(hashes, self._a) + self._b) % self._PRIME
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, tokens: Iterable[str]):
+        """Insert or replace the signature stored for key"""
+        self.remove(key)
+        signature = self.signature(tokens)
+        if signature is None:
+            return
+        keys = self._band_keys(signature)
+        self.band_keys[key] = keys
+        for band, band_key in enumerate(keys):
+            self.buckets[band][band_key].add(key)
+
+    def remove(self, key):
+        keys = self.band_keys.pop(key, None)
+        if keys is None:
+            return
+        for band, band_key in enumerate(keys):
+            bucket = self.buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band][band_key]
+
+    def candidates(self, tokens: Iterable[str]) -> set:
+        """Return keys sharing at least one band with the query"""
+        signature = self.signature(tokens)
+        if signature is None:
+            return set()
+        found = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self.buckets[band].get(band_key)
+            if bucket:
+                found.update(bucket)
+        return found
+
+
+class NearDuplicateIndex:
+    """Near-duplicate lookup over learned question/response items.
+
+    Items are plain dicts with a ``question`` field, tracked by identity so
+    callers can keep mutating them in place. Lookups take the LSH candidates
+    and re-check them with exact Jaccard.
+    """
+
+    def __init__(self, num_perm: int = 256, rows: int = 4):
+        self.lsh = MinHashLSH(num_perm, rows)
+        self.entries = {}
+        self._next_seq = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, item: Dict):
+        tokens = frozenset(tokenize_text(item['question']))
+        self.entries[id(item)] = (self._next_seq, item, tokens)
+        self._next_seq += 1
+        self.lsh.add(id(item), tokens)
+
+    def remove(self, item: Dict):
+        if self.entries.pop(id(item), None) is not None:
+            self.lsh.remove(id(item))
+
+    def similar(self, text: str) -> List[Tuple[Dict, float]]:
+        """Return (item, jaccard) for candidate items, in insertion order"""
+        query = frozenset(tokenize_text(text))
+        matches = []
+        for key in self.lsh.candidates(query):
+            seq, item, tokens = self.entries[key]
+            similarity = len(query & tokens) / len(query | tokens)
+            matches.append((seq, item, similarity))
+        matches.sort(key=lambda match: match[0])
+        return [(item, similarity) for _, item, similarity in matches]
+
+
+def hashed_features(text: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Signed feature hashing of a question's words and their character trigrams.
+
+    Returns the (bucket, value) pairs of a term-frequency vector, one pair
+    per bucket. crc32 keeps the buckets stable across processes. Trigrams,
+    at half a word's weight, let inflections such as "orbit" and "orbiting"
+    overlap.
+    """
+    counts = defaultdict(float)
+    for token in tokenize_text(text):
+        word = token.strip('?!')
+        if not word:
+            continue
+        padded = f"<{word}>"
+        features = [(word, 1.0)] + [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+        for feature, weight in features:
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            counts[hashed % dim] += weight if hashed & 0x80000000 else -weight
+    buckets = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return buckets, values
+
+
+class SemanticIndex:
+    """Hashed TF-IDF vectors of learned questions in one contiguous matrix.
+
+    Each item is a row of a float32 matrix of unit vectors, so a query is
+    scored against every item with a single matrix-vector product and the
+    top k come from argpartition. The vectors need no model and no network.
+    The IDF weights are applied when a row is written. Rows are rewritten
+    with fresh weights each time the index doubles in size, so the weights
+    drift at most by a factor of two in document count. Removing an item
+    moves the last row into its place. Items are tracked by identity, like
+    NearDuplicateIndex, and each row remembers the item's subject.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.matrix = np.zeros((0, dim), dtype=np.float32)  # rows past len(self) are unused
+        self.subject_codes = np.zeros(0, dtype=np.int32)
+        self.subject_ids = {}
+        self.items = []
+        self.features = []  # per row: buckets and term frequencies before IDF
+        self.rows = {}  # id(item) -> row
+        self.doc_freq = np.zeros(dim, dtype=np.float64)
+        self.weighted_size = 0  # size when every row was last weighted
+
+    def __len__(self):
+        return len(self.items)
+
+    def _idf(self) -> np.ndarray:
+        return (np.log((1 + len(self.items)) / (1 + self.doc_freq)) + 1).astype(np.float32)
+
+    def _vector(self, buckets: np.ndarray, values: np.ndarray, idf: np.ndarray) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        vector[buckets] = values * idf[buckets]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, item: Dict, subject: str):
+        buckets, values = hashed_features(item['question'], self.dim)
+        row = len(self.items)
+        if row == len(self.matrix):
+            capacity = max(16, 2 * row)
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[:row] = self.matrix[:row]
+            codes = np.zeros(capacity, dtype=np.int32)
+            codes[:row] = self.subject_codes[:row]
+            self.matrix, self.subject_codes = matrix, codes
+        self.subject_codes[row] = self.subject_ids.setdefault(subject, len(self.subject_ids))
+        self.doc_freq[buckets] += 1
+        self.items.append(item)
+        self.features.append((buckets, values))
+        self.rows[id(item)] = row
+        if len(self.items) >= 2 * self.weighted_size:
+            self._reweight()
+        else:
+            self.matrix[row] = self._vector(buckets, values, self._idf())
+
+    def remove(self, item: Dict):
+        row = self.rows.pop(id(item), None)
+        if row is None:
+            return
+        self.doc_freq[self.features[row][0]] -= 1
+        last = len(self.items) - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.subject_codes[row] = self.subject_codes[last]
+            self.items[row] = self.items[last]
+            self.features[row] = self.features[last]
+            self.rows[id(self.items[row])] = row
+        self.items.pop()
+        self.features.pop()
+
+    def clear(self):
+        self.__init__(self.dim)
+
+    def _reweight(self):
+        """Rewrite every row with the current IDF weights"""
+        size = len(self.items)
+        idf = self._idf()
+        lengths = [len(buckets) for buckets, _ in self.features]
+        rows = np.repeat(np.arange(size), lengths)
+        buckets = np.concatenate([buckets for buckets, _ in self.features])
+        values = np.concatenate([values for _, values in self.features])
+        block = self.matrix[:size]
+        block[:] = 0
+        block[rows, buckets] = values * idf[buckets]
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        block /= norms
+        self.weighted_size = size
+
+    def search(self, text: str, k: int = 5, threshold: float = 0.0,
+               subject: Optional[str] = None) -> List[Tuple[Dict, float]]:
+        """Return up to k (item, cosine) pairs scoring at least threshold, best first"""
+        size = len(self.items)
+        buckets, values = hashed_features(text, self.dim)
+        if not size or not len(buckets):
+            return []
+        scores = self.matrix[:size] @ self._vector(buckets, values, self._idf())
+        if subject is not None:
+            code = self.subject_ids.get(subject)
+            if code is None:
+                return []
+            scores = np.where(self.subject_codes[:size] == code, scores, -1.0)
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.items[row], float(scores[row])) for row in top if scores[row] >= threshold]
+
+
+class KnowledgeIndex:
+    """Flat, pre-lowercased view of the nested knowledge base.
+
+    Every string leaf becomes a row of a per-subject table, in the same
+    depth-first order as the nested dict. Character trigram postings over
+    keys and values find the leaves a keyword can occur in, and a key table
+    finds leaves whose key occurs inside a keyword. Success-pattern boosts
+    are kept as counters per ``"{subject}_{key}"`` pattern key.
+    """
+
+    def __init__(self):
+        self.leaves = {}
+        self.grams = {}
+        self.keys = {}
+        self.pattern_leaves = defaultdict(list)
+        self.success_counts = defaultdict(int)
+        self.boosted = defaultdict(set)
+
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def compile(self, knowledge_base: Dict):
+        """Rebuild the flat tables from the nested knowledge base"""
+        self.leaves.clear()
+        self.grams.clear()
+        self.keys.clear()
+        self.pattern_leaves.clear()
+
+        for subject, subject_kb in knowledge_base.items():
+            if not isinstance(subject_kb, dict):
+                continue
+            leaves = []
+            grams = defaultdict(set)
+            keys = defaultdict(list)
+
+            def walk(data, path=""):
+                for key, value in data.items():
+                    if isinstance(value, str):
+                        leaf_id = len(leaves)
+                        key_lower, value_lower = key.lower(), value.lower()
+                        pattern_key = f"{subject}_{key}"
+                        leaves.append((key, value, path, key_lower, value_lower, pattern_key))
+                        for gram in self._trigrams(key_lower) | self._trigrams(value_lower):
+                            grams[gram].add(leaf_id)
+                        keys[key_lower].append(leaf_id)
+                        self.pattern_leaves[pattern_key].append((subject, leaf_id))
+                    elif isinstance(value, dict):
+                        walk(value, f"{path}/{key}" if path else key)
+
+            walk(subject_kb)
+            self.leaves[subject] = leaves
+            self.grams[subject] = dict(grams)
+            self.keys[subject] = dict(keys)
+
+        self._refresh_boosted()
+
+    def set_success_counts(self, counts: Dict[str, int]):
+        self.success_counts = defaultdict(int, counts)
+        self._refresh_boosted()
+
+    def _refresh_boosted(self):
+        self.boosted.clear()
+        for pattern_key, count in self.success_counts.items():
+            if count:
+                for subject, leaf_id in self.pattern_leaves.get(pattern_key, ()):
+                    self.boosted[subject].add(leaf_id)
+
+    def record_success(self, pattern_key: str, count: int = 1):
+        self.success_counts[pattern_key] += count
+        for subject, leaf_id in self.pattern_leaves.get(pattern_key, ()):
+            self.boosted[subject].add(leaf_id)
+
+    def _candidates(self, subject: str, keywords: Iterable[str]) -> set:
+        leaves = self.leaves[subject]
+        grams = self.grams[subject]
+        keys = self.keys[subject]
+        candidates = set(self.boosted.get(subject, ()))
+        for keyword in set(keywords):
+            if len(keyword) < 3:
+                # Too short for trigram lookup; rare enough to scan
+                candidates.update(range(len(leaves)))
+                break
+            # Leaves whose key or value contain the keyword
+            postings = [grams.get(gram) for gram in self._trigrams(keyword)]
+            if all(postings):
+                candidates.update(set.intersection(*postings))
+            # Leaves whose key is contained in the keyword
+            for start in range(len(keyword)):
+                for end in range(start + 1, len(keyword) + 1):
+                    candidates.update(keys.get(keyword[start:end], ()))
+        return candidates
+
+    def search(self, subject: str, keywords: List[str]) -> Optional[Tuple[str, str, str]]:
+        """Return (key, value, path) of the best-scoring leaf, or None"""
+        if subject not in self.leaves:
+            return None
+        leaves = self.leaves[subject]
+        best_match = None
+        best_score = 0
+        # Visit candidates in nested-dict order so ties keep the first leaf
+        for leaf_id in sorted(self._candidates(subject, keywords)):
+            key, value, path, key_lower, value_lower, pattern_key = leaves[leaf_id]
+            key_score = sum(1 for keyword in keywords if keyword in key_lower or key_lower in keyword)
+            content_score = sum(1 for keyword in keywords if keyword in value_lower)
+            if self.success_counts.get(pattern_key):
+                content_score += self.success_counts[pattern_key] * 0.5
+            total_score = key_score * 2 + content_score
+            if total_score > best_score:
+                best_score = total_score
+                best_match = (key, value, path)
+        return best_match
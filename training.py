@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from answer_cache import normalize_prompt
+
+
+class RateLimiter:
+    """Token bucket allowing requests_per_minute calls, with bursts up to burst"""
+
+    def __init__(self, requests_per_minute: float, burst: Optional[int] = None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst or max(1, int(requests_per_minute) // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class TrainingPool:
+    """Fixed pool of worker threads running train(question) from a bounded queue.
+
+    A question whose normalized form is already queued or being trained is
+    dropped as a duplicate, and one arriving while the queue is full is
+    dropped rather than blocking the caller. When requests_per_minute is set,
+    workers wait for the rate limiter before each call so the pool stays
+    within the Gemini quota. Workers start on the first submit. close()
+    stops accepting work and drains what is queued.
+    """
+
+    def __init__(self, train: Callable[[str], None], workers: int = 2, max_queue: int = 100,
+                 requests_per_minute: Optional[float] = 60):
+        self.train = train
+        self.workers = workers
+        self.max_queue = max_queue
+        self.limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped_duplicate = 0
+        self.dropped_full = 0
+        self.dropped_closed = 0
+        self.throttled_seconds = 0.0
+        self._queue = deque()
+        self._pending = set()  # keys queued or being trained
+        self._active = 0
+        self._threads = []
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def submit(self, question: str) -> bool:
+        """Queue question for training; False if it was dropped"""
+        key = normalize_prompt(question)
+        with self._cond:
+            if self._closed:
+                self.dropped_closed += 1
+                return False
+            if not key or key in self._pending:
+                self.dropped_duplicate += 1
+                return False
+            if len(self._queue) >= self.max_queue:
+                self.dropped_full += 1
+                return False
+            if not self._threads:
+                self._start()
+            self._queue.append((key, question))
+            self._pending.add(key)
+            self.submitted += 1
+            self._cond.notify()
+            return True
+
+    def _start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'liam-train-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                key, question = self._queue.popleft()
+                self._active += 1
+            try:
+                if self.limiter is not None:
+                    delay = self.limiter.reserve()
+                    if delay > 0:
+                        with self._cond:
+                            self.throttled_seconds += delay
+                        time.sleep(delay)
+                self.train(question)
+                succeeded = True
+            except Exception as e:
+                print(f"Error training on {question!r}: {e}")
+                succeeded = False
+            with self._cond:
+                self._active -= 1
+                self._pending.discard(key)
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._cond.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the queue is empty and no worker is busy; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._active, timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop accepting questions and let the workers drain the queue.
+
+        Questions still queued after timeout seconds are discarded.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        with self._cond:
+            self.dropped_closed += len(self._queue)
+            self._queue.clear()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'queue_depth': len(self._queue),
+                'in_flight': self._active,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped_duplicate': self.dropped_duplicate,
+                'dropped_full': self.dropped_full,
+                'dropped_closed': self.dropped_closed,
+                'throttled_seconds': self.throttled_seconds
+            }
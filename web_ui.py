@@ -0,0 +1,147 @@
+"""HTML for the single-page web UI, shared by the Flask and ASGI servers"""
+
+INDEX_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Liam AI Web UI</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', Arial, sans-serif;
+            background: linear-gradient(120deg, #f8fafc 0%, #e0e7ef 100%);
+            margin: 0;
+            padding: 0;
+            min-height: 100vh;
+        }
+        h1 {
+            text-align: center;
+            color: #2d3a4b;
+            margin-top: 40px;
+            margin-bottom: 30px;
+            letter-spacing: 1px;
+        }
+        #ai-form {
+            background: #fff;
+            max-width: 420px;
+            margin: 0 auto;
+            padding: 32px 28px 24px 28px;
+            border-radius: 18px;
+            box-shadow: 0 4px 24px rgba(44, 62, 80, 0.08);
+            display: flex;
+            flex-direction: column;
+            gap: 18px;
+        }
+        #user-input {
+            padding: 12px 14px;
+            border: 1px solid #cfd8dc;
+            border-radius: 8px;
+            font-size: 1.1em;
+            outline: none;
+            transition: border 0.2s;
+        }
+        #user-input:focus {
+            border: 1.5px solid #5b9df9;
+        }
+        label {
+            display: flex;
+            align-items: center;
+            font-size: 1em;
+            color: #3a4a5d;
+            gap: 8px;
+        }
+        button {
+            background: linear-gradient(90deg, #5b9df9 0%, #3a8dde 100%);
+            color: #fff;
+            border: none;
+            border-radius: 8px;
+            padding: 12px 0;
+            font-size: 1.1em;
+            font-weight: 600;
+            cursor: pointer;
+            box-shadow: 0 2px 8px rgba(44, 62, 80, 0.07);
+            transition: background 0.2s, transform 0.1s;
+        }
+        button:hover {
+            background: linear-gradient(90deg, #3a8dde 0%, #5b9df9 100%);
+            transform: translateY(-2px) scale(1.03);
+        }
+        #result {
+            max-width: 420px;
+            margin: 32px auto 0 auto;
+            background: #fff;
+            border-radius: 14px;
+            box-shadow: 0 2px 12px rgba(44, 62, 80, 0.07);
+            padding: 22px 20px;
+            font-size: 1.08em;
+            color: #2d3a4b;
+            min-height: 40px;
+            word-break: break-word;
+            white-space: pre-line;
+        }
+        @media (max-width: 600px) {
+            #ai-form, #result {
+                max-width: 98vw;
+                padding: 16px 6vw;
+            }
+            h1 {
+                font-size: 1.3em;
+            }
+        }
+    </style>
+</head>
+<body>
+    <h1>Liam AI Web Interface</h1>
+    <form id="ai-form">
+        <input type="text" id="user-input" placeholder="Enter your input" required>
+        <button type="submit">Submit</button>
+    </form>
+    <div id="result"></div>
+    <script>
+    // The server keeps this tab's conversation context under its session id
+    let sessionId = sessionStorage.getItem('liam-session');
+    document.getElementById('ai-form').onsubmit = async function(e) {
+        e.preventDefault();
+        const userInput = document.getElementById('user-input').value;
+        const result = document.getElementById('result');
+        result.innerText = '';
+        const response = await fetch('/predict/stream', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({input: userInput, use_gemini: true, session_id: sessionId})
+        });
+        if (response.headers.get('X-Session-Id')) {
+            sessionId = response.headers.get('X-Session-Id');
+            sessionStorage.setItem('liam-session', sessionId);
+        }
+        if (!response.ok || !response.body) {
+            const data = await response.json();
+            result.innerText = data.message || data.error || JSON.stringify(data);
+            return;
+        }
+        // Render server-sent events as they arrive: "event: <name>\ndata: <json>\n\n"
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const {done, value} = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, {stream: true});
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message', data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                const payload = JSON.parse(data);
+                if (event === 'chunk') result.innerText += payload.text;
+                else if (event === 'error') result.innerText += (result.innerText ? '\n\n' : '') + payload.message;
+            }
+        }
+    }
+    </script>
+</body>
+</html>
+"""